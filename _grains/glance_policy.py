@@ -1,15 +1,193 @@
 #!/usr/bin/env python
+import hashlib
+import json
+import logging
+import os
+import re
+
 import salt.config
 import salt.loader
 
+log = logging.getLogger(__name__)
 
-def main():
-    path = "/etc/glance/policy.json"
-    __opts__ = salt.config.minion_config('/etc/salt/minion')
-    keystone_policy_mod = salt.loader.raw_mod(__opts__, 'keystone_policy', None)
-    if keystone_policy_mod:
+POLICY_FILE = '/etc/glance/policy.json'
+# Parsed rules are kept in the minion cachedir together with the mtime,
+# size and inode of the policy file they were parsed from
+CACHE_FILE = 'glance_policy.json'
+
+_TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+# Rules that allow everyone
+_OPEN_RULES = ('', '@')
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size, st.st_ino]
+
+
+def _opts():
+    # The grains loader provides __opts__, only a standalone run has to
+    # build the minion config
+    opts = globals().get('__opts__')
+    if not opts:
+        opts = salt.config.minion_config('/etc/salt/minion')
+    return opts
+
+
+def _load_cache(cache_file, path):
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if cached.get('path') != path:
+        return {}
+    return cached
+
+
+def _save_cache(cache_file, path, signature, rules, index):
+    tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'path': path, 'signature': signature,
+                       'rules': rules, 'index': index}, f)
+        os.rename(tmp, cache_file)
+    except (IOError, OSError, TypeError, ValueError) as e:
+        log.debug('Unable to cache glance policy rules: {}'.format(e))
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def _parse(opts, path):
+    keystone_policy_mod = salt.loader.raw_mod(opts, 'keystone_policy', None)
+    if keystone_policy_mod and \
+            'keystone_policy.rule_list' in keystone_policy_mod:
         result = keystone_policy_mod['keystone_policy.rule_list'](path)
         if result and 'Error' not in result:
-            return {'glance_policy': result}
-    return {}
+            return result
+    return None
 
+
+def _expression(rule):
+    if isinstance(rule, list):
+        # Legacy list syntax, a list of alternatives of checks to match
+        return ' or '.join(
+            '({})'.format(' and '.join(alternative))
+            if isinstance(alternative, list) else alternative
+            for alternative in rule)
+    return rule or ''
+
+
+def _references(rule):
+    """Return the roles and rules a rule refers to outside of negations"""
+    roles, rules = set(), set()
+    stack = []
+    negated = negate_next = False
+    for token in _TOKEN_RE.findall(_expression(rule)):
+        word = token.lower()
+        if word == 'not':
+            negate_next = not negate_next
+        elif word in ('and', 'or'):
+            continue
+        elif token == '(':
+            stack.append(negated)
+            negated, negate_next = negated != negate_next, False
+        elif token == ')':
+            negated = stack.pop() if stack else False
+        else:
+            kind, _, match = token.partition(':')
+            if negated == negate_next:
+                if kind == 'role':
+                    roles.add(match.lower())
+                elif kind == 'rule':
+                    rules.add(match)
+            negate_next = False
+    return roles, rules
+
+
+def _build_index(rules, previous=None):
+    """Index the rules by referenced role with rule references resolved
+
+    Every rule gets the roles and rules it refers to, directly or through
+    other rules, and a digest covering the rules it depends on. ``roles``
+    maps a role to the rules referring to it, ``open`` holds the rules
+    allowing everyone and ``changed`` the rules added, modified or
+    removed compared to the ``previous`` index.
+    """
+    direct = dict((name, _references(rule)) for name, rule in rules.items())
+    resolved = {}
+
+    def resolve(name, seen):
+        if name in resolved:
+            return resolved[name]
+        roles, refs = set(), set()
+        digest = hashlib.sha1(
+            json.dumps(rules.get(name), sort_keys=True).encode('utf-8'))
+        own_roles, own_refs = direct.get(name, (set(), set()))
+        roles.update(own_roles)
+        for ref in sorted(own_refs):
+            refs.add(ref)
+            if ref in seen or ref not in rules:
+                continue
+            entry = resolve(ref, seen | set([name]))
+            roles.update(entry['roles'])
+            refs.update(entry['rules'])
+            digest.update(entry['digest'].encode('utf-8'))
+        entry = {
+            'roles': sorted(roles),
+            'rules': sorted(refs),
+            'open': _expression(rules.get(name)).strip() in _OPEN_RULES,
+            'digest': digest.hexdigest(),
+        }
+        if not seen:
+            resolved[name] = entry
+        return entry
+
+    index = {'rules': {}, 'roles': {}, 'open': {}, 'changed': {}}
+    for name in rules:
+        entry = index['rules'][name] = resolve(name, set())
+        for role in entry['roles']:
+            index['roles'].setdefault(role, {})[name] = rules[name]
+        if entry['open']:
+            index['open'][name] = rules[name]
+
+    old = (previous or {}).get('rules') or {}
+    if previous:
+        for name, entry in index['rules'].items():
+            if name not in old:
+                index['changed'][name] = 'added'
+            elif old[name].get('digest') != entry['digest']:
+                index['changed'][name] = 'modified'
+        for name in old:
+            if name not in index['rules']:
+                index['changed'][name] = 'removed'
+    index['digest'] = hashlib.sha1(json.dumps(
+        sorted((n, e['digest']) for n, e in index['rules'].items())
+    ).encode('utf-8')).hexdigest()
+    return index
+
+
+def main():
+    path = POLICY_FILE
+    signature = _signature(path)
+    if signature is None:
+        return {}
+    opts = _opts()
+    cache_file = os.path.join(opts.get('cachedir', '/var/cache/salt/minion'),
+                              CACHE_FILE)
+    cached = _load_cache(cache_file, path)
+    rules, index = cached.get('rules'), cached.get('index')
+    if cached.get('signature') != signature or rules is None or \
+            index is None:
+        rules = _parse(opts, path)
+        if rules is None:
+            return {}
+        index = _build_index(rules, index)
+        _save_cache(cache_file, path, signature, rules, index)
+    else:
+        # Changes are reported once, by the refresh that parsed them
+        index = dict(index, changed={})
+    return {'glance_policy': rules, 'glance_policy_index': index}
@@ -43,9 +43,12 @@ following functions:
 
 # Import Python libs
 from __future__ import absolute_import
+import functools
+import json
 import logging
-import pprint
+import os
 import re
+import time
 
 # Import salt libs
 from salt.exceptions import SaltInvocationError
@@ -57,26 +60,44 @@ from salt.version import (
 
 from salt.utils import warn_until
 
-# pylint: disable=import-error
-HAS_GLANCE = False
 try:
-    from glanceclient import client
-    from glanceclient import exc
-    HAS_GLANCE = True
+    from importlib.util import find_spec
 except ImportError:
-    pass
+    import imp
+    find_spec = None
 
+# glanceclient is only looked up when the module is loaded and imported
+# on first use, see _import_glanceclient()
+client = None
+exc = None
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
+def _has_glanceclient():
+    if find_spec is not None:
+        return find_spec('glanceclient') is not None
+    try:
+        imp.find_module('glanceclient')
+    except ImportError:
+        return False
+    return True
+
+
+def _import_glanceclient():
+    global client, exc
+    if exc is None:
+        # pylint: disable=import-error
+        from glanceclient import client
+        from glanceclient import exc
+
+
 def __virtual__():
     '''
     Only load this module if glance
     is installed on this minion.
     '''
-    if not HAS_GLANCE:
+    if not _has_glanceclient():
         return False, ("The glance execution module cannot be loaded: "
                        "the glanceclient python library is not available.")
     return True
@@ -84,6 +105,38 @@ def __virtual__():
 
 __opts__ = {}
 
+# glanceclient instances and their endpoints shared by all calls in this
+# process, keyed by (profile, api_version, connection_args)
+_CLIENTS = {}
+
+# Schema properties keyed by (endpoint, schema name), each entry holds
+# the fetch time, the properties and the precomputed set of their names
+_SCHEMAS = {}
+# Seconds a fetched schema is trusted, schemas only change on upgrades
+SCHEMA_CACHE_TTL = 86400
+SCHEMA_CACHE_FILE = 'glanceng_schemas.json'
+
+# Task watchers shared by all calls in this process, keyed by profile
+_WATCHERS = {}
+TASK_FINAL_STATUSES = ('success', 'failure')
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+def _connect(profile=None, api_version=2, **connection_args):
+    '''
+    Return the cached (client, endpoint) pair of the profile
+    '''
+    key = (profile, api_version, repr(sorted(connection_args.items())))
+    if key in _CLIENTS:
+        return _CLIENTS[key]
+    _import_glanceclient()
+    kstone = __salt__['keystoneng.auth'](profile, **connection_args)
+    g_endpoint = __salt__['keystoneng.endpoint_get']('glance', profile=profile)
+    glance_client = client.Client(api_version, session=kstone.session, endpoint=g_endpoint.get('url'))
+    _CLIENTS[key] = (glance_client, g_endpoint.get('url'))
+    return _CLIENTS[key]
+
 
 def _auth(profile=None, api_version=2, **connection_args):
     '''
@@ -91,13 +144,30 @@ def _auth(profile=None, api_version=2, **connection_args):
     `glanceclient.client.Client`. Optional parameter
     "api_version" defaults to 2.
 
+    Clients are cached per profile, API version and connection
+    arguments, see :func:`_reauth_on_unauthorized` for invalidation.
+
     Only intended to be used within glance-enabled modules
     '''
+    return _connect(profile, api_version, **connection_args)[0]
 
-    kstone = __salt__['keystoneng.auth'](profile, **connection_args)
-    g_endpoint = __salt__['keystoneng.endpoint_get']('glance', profile=profile)
-    glance_client = client.Client(api_version, session=kstone.session, endpoint=g_endpoint.get('url'))
-    return glance_client
+
+def _reauth_on_unauthorized(func):
+    '''
+    Retry the call once with fresh clients if glance answers with 401
+    '''
+    @functools.wraps(func)
+    def wrapped_f(*args, **kwargs):
+        # Remove salt internal kwargs
+        for k in [k for k in kwargs if k.startswith('__')]:
+            kwargs.pop(k)
+        _import_glanceclient()
+        try:
+            return func(*args, **kwargs)
+        except exc.HTTPUnauthorized:
+            _CLIENTS.clear()
+            return func(*args, **kwargs)
+    return wrapped_f
 
 
 def _validate_image_params(visibility=None, container_format='bare',
@@ -165,6 +235,7 @@ def _validate_task_params(task_type, input_params):
         _validate_image_params(**image_properties)
 
 
+@_reauth_on_unauthorized
 def task_create(task_type, profile=None, input_params=None):
     """
     Create a Glance V2 task of a given type
@@ -184,6 +255,7 @@ def task_create(task_type, profile=None, input_params=None):
     return created_task
 
 
+@_reauth_on_unauthorized
 def task_show(task_id, profile=None):
     """
     Show a Glance V2 task
@@ -193,7 +265,6 @@ def task_show(task_id, profile=None):
     :return: Dictionary with created task's parameters
     """
     g_client = _auth(profile)
-    ret = {}
     try:
         task = g_client.tasks.get(task_id)
     except exc.HTTPNotFound:
@@ -201,19 +272,14 @@ def task_show(task_id, profile=None):
             'result': False,
             'comment': 'No task with ID {0}'.format(task_id)
         }
-    pformat = pprint.PrettyPrinter(indent=4).pformat
-    log.debug('Properties of task {0}:\n{1}'.format(
-        task_id, pformat(task)))
-
-    schema = image_schema(schema_type='task', profile=profile)
-    if len(schema.keys()) == 1:
-        schema = schema['task']
-    for key in schema.keys():
-        if key in task:
-            ret[key] = task[key]
-    return ret
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Task %s: %s', task_id, _summary(task, ('type', 'status')))
+
+    keys = _schema('task', profile)[1]
+    return _project(task, keys)
 
 
+@_reauth_on_unauthorized
 def task_list(profile=None):
     """
     List Glance V2 tasks
@@ -224,18 +290,126 @@ def task_list(profile=None):
     g_client = _auth(profile)
     ret = {}
     tasks = g_client.tasks.list()
-    schema = image_schema(schema_type='task', profile=profile)
-    if len(schema.keys()) == 1:
-        schema = schema['task']
+    keys = _schema('task', profile)[1]
     for task in tasks:
-        task_dict = {}
-        for key in schema.keys():
-            if key in task:
-                task_dict[key] = task[key]
-        ret[task['id']] = task_dict
+        ret[task['id']] = _project(task, keys)
     return ret
 
 
+class _TaskWatcher(object):
+    '''
+    Tracks a set of tasks of one profile and polls only those still in
+    flight with targeted ``tasks.get`` calls.
+
+    The poll interval grows with the number of tasks in flight, between
+    ``min_interval`` and ``max_interval`` seconds.
+    '''
+
+    min_interval = 1.0
+    max_interval = 10.0
+    interval_per_task = 0.5
+
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.pending = set()
+        self.finished = {}
+        self.last_seen = {}
+
+    def add(self, task_id):
+        if task_id not in self.finished:
+            self.pending.add(task_id)
+
+    def interval(self):
+        return min(self.max_interval,
+                   max(self.min_interval,
+                       self.interval_per_task * len(self.pending)))
+
+    def poll(self):
+        '''
+        Refresh every task in flight, vanished tasks finish as None
+        '''
+        g_client = _auth(self.profile)
+        keys = _schema('task', self.profile)[1]
+        for task_id in list(self.pending):
+            try:
+                task = _project(g_client.tasks.get(task_id), keys)
+            except exc.HTTPNotFound:
+                task = None
+            if task is None or task.get('status') in TASK_FINAL_STATUSES:
+                self.pending.discard(task_id)
+                self.last_seen.pop(task_id, None)
+                self.finished[task_id] = task
+            else:
+                self.last_seen[task_id] = task
+
+    def watch(self, task_ids, timeout=30):
+        '''
+        Yield (task_id, task) for the given tasks as they finish, then
+        the last known state of those still running at the timeout
+        '''
+        wanted = set(task_ids)
+        for task_id in wanted:
+            self.add(task_id)
+        deadline = _monotonic() + timeout
+        # Tasks may already be done, look once before the first sleep
+        if wanted - set(self.finished):
+            self.poll()
+        while wanted:
+            for task_id in wanted & set(self.finished):
+                wanted.discard(task_id)
+                yield task_id, self.finished.pop(task_id)
+            if not wanted:
+                return
+            remaining = deadline - _monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.interval(), remaining))
+            self.poll()
+        for task_id in wanted:
+            self.pending.discard(task_id)
+            yield task_id, self.last_seen.pop(task_id, {'id': task_id})
+
+
+def _task_watcher(profile=None):
+    '''
+    Return the watcher shared by all calls for the profile
+    '''
+    if profile not in _WATCHERS:
+        _WATCHERS[profile] = _TaskWatcher(profile)
+    return _WATCHERS[profile]
+
+
+@_reauth_on_unauthorized
+def tasks_wait(task_ids, profile=None, timeout=30):
+    """
+    Wait for Glance V2 tasks to finish
+
+    Tasks are polled one by one, together with the tasks other callers
+    wait for on the same profile.
+
+    :param task_ids: List of task IDs
+    :param profile: Authentication profile
+    :param timeout: Seconds to wait for all tasks
+    :return: Dictionary of task ID to its last known parameters, or None
+             if the task vanished
+    """
+    return dict(_task_watcher(profile).watch(task_ids, timeout=timeout))
+
+
+def task_wait(task_id, profile=None, timeout=30):
+    """
+    Wait for a Glance V2 task to finish
+
+    :param task_id: ID of a task
+    :param profile: Authentication profile
+    :param timeout: Seconds to wait for the task
+    :return: Dictionary with the task's last known parameters, or None
+             if the task vanished
+    """
+    return tasks_wait([task_id], profile=profile, timeout=timeout)[task_id]
+
+
+@_reauth_on_unauthorized
 def get_image_owner_id(name, profile=None):
     """
     Mine function to get image owner
@@ -245,18 +419,9 @@ def get_image_owner_id(name, profile=None):
     :return: Image owner ID or [] if image is not found
     """
     g_client = _auth(profile)
-    image_id = None
-    for image in g_client.images.list():
-        if image.name == name:
-            image_id = image.id
-            continue
-    if not image_id:
-        return []
-    try:
-        image = g_client.images.get(image_id)
-    except exc.HTTPNotFound:
-        return []
-    return image['owner']
+    for image in g_client.images.list(filters={'name': name}, limit=1):
+        return image['owner']
+    return []
 
 
 def image_schema(schema_type='image', profile=None):
@@ -273,7 +438,84 @@ def image_schema(schema_type='image', profile=None):
     return schema_get(schema_type, profile)
 
 
-def schema_get(name, profile=None):
+def _schema_cache_path():
+    cachedir = __opts__.get('cachedir')
+    if not cachedir:
+        return None
+    return os.path.join(cachedir, SCHEMA_CACHE_FILE)
+
+
+def _load_schema_cache():
+    '''
+    Fill the in-memory schema cache from the minion cache directory
+    '''
+    path = _schema_cache_path()
+    if _SCHEMAS or not path:
+        return
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (IOError, OSError, ValueError):
+        return
+    for entry in entries:
+        _SCHEMAS[(entry['endpoint'], entry['name'])] = (
+            entry['fetched_at'], entry['properties'],
+            frozenset(entry['properties']))
+
+
+def _save_schema_cache():
+    path = _schema_cache_path()
+    if not path:
+        return
+    entries = [{'endpoint': endpoint, 'name': name, 'fetched_at': fetched_at,
+                'properties': properties}
+               for (endpoint, name), (fetched_at, properties, _)
+               in _SCHEMAS.items()]
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entries, f)
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError) as err:
+        log.debug('Unable to save glance schema cache: {0}'.format(err))
+
+
+def _schema(name, profile=None, refresh=False):
+    '''
+    Return the (properties, property names) of a schema, fetching it from
+    glance only when it is not cached or older than the cache TTL
+    '''
+    g_client, endpoint = _connect(profile)
+    _load_schema_cache()
+    ttl = __opts__.get('glanceng.schema_cache_ttl', SCHEMA_CACHE_TTL)
+    cached = _SCHEMAS.get((endpoint, name))
+    if cached and not refresh and time.time() - cached[0] < ttl:
+        return cached[1], cached[2]
+    schema_props = {}
+    for prop in g_client.schemas.get(name).properties:
+        schema_props[prop.name] = prop.description
+    _SCHEMAS[(endpoint, name)] = (time.time(), schema_props,
+                                  frozenset(schema_props))
+    _save_schema_cache()
+    return schema_props, _SCHEMAS[(endpoint, name)][2]
+
+
+def _project(record, keys):
+    '''
+    Keep only the attributes of a glance record named in the schema
+    '''
+    return dict((key, record[key]) for key in keys if key in record)
+
+
+def _summary(record, keys):
+    '''
+    Return a short ``key=value`` description of a glance record
+    '''
+    return ' '.join('{0}={1}'.format(key, record.get(key))
+                    for key in keys)
+
+
+@_reauth_on_unauthorized
+def schema_get(name, profile=None, refresh=False):
     '''
     Known valid names of schemas are:
       - image
@@ -281,52 +523,71 @@ def schema_get(name, profile=None):
       - member
       - members
 
+    Schemas are cached on disk per glance endpoint for
+    ``glanceng.schema_cache_ttl`` seconds (a day by default), pass
+    ``refresh=True`` to fetch it again.
+
     CLI Example:
 
     .. code-block:: bash
 
         salt '*' glance.schema_get name=f16-jeos
     '''
-    g_client = _auth(profile)
-    pformat = pprint.PrettyPrinter(indent=4).pformat
-    schema_props = {}
-    for prop in g_client.schemas.get(name).properties:
-        schema_props[prop.name] = prop.description
-    log.debug('Properties of schema {0}:\n{1}'.format(
-        name, pformat(schema_props)))
-    return {name: schema_props}
+    schema_props = _schema(name, profile, refresh)[0]
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Schema %s: %d properties (%s)', name, len(schema_props),
+                  ', '.join(sorted(schema_props)))
+    return {name: dict(schema_props)}
 
-def image_list(id=None, profile=None, name=None):  # pylint: disable=C0103
+def _image_id_by_name(g_client, name):
+    '''
+    Return the ID of the first image named ``name`` or None
+    '''
+    for image in g_client.images.list(filters={'name': name}, limit=1):
+        return image.id
+    return None
+
+
+@_reauth_on_unauthorized
+def image_list(id=None, profile=None, name=None, limit=None, marker=None,  # pylint: disable=C0103
+               page_size=None):
     '''
     Return a list of available images (glance image-list)
 
+    Filtering by ``id`` or ``name`` is done by glance. ``limit`` caps the
+    number of returned images, ``marker`` is the ID of the image after
+    which to start and ``page_size`` the number of images fetched per
+    request.
+
     CLI Example:
 
     .. code-block:: bash
 
         salt '*' glance.image_list
+        salt '*' glance.image_list name=f16-jeos
+        salt '*' glance.image_list limit=100 marker=c2eb2eb0-53e1-4a80-b990-8ec887eae7df
     '''
 
     g_client = _auth(profile)
     ret = []
-    for image in g_client.images.list():
-        if id is None and name is None:
+    if id is not None:
+        try:
+            image = g_client.images.get(id)
+        except exc.HTTPNotFound:
+            return ret
+        if name is None or image.name == name:
             _add_image(ret, image)
-        else:
-            if id is not None and id == image.id:
-                _add_image(ret, image)
-                return ret
-            if name == image.name:
-                if name in ret:
-                    # Not really worth an exception
-                    return {
-                        'result': False,
-                        'comment':
-                            'More than one image with '
-                            'name "{0}"'.format(name)
-                        }
-                _add_image(ret, image)
-    log.debug('Returning images: {0}'.format(ret))
+        return ret
+    list_kwargs = {}
+    if name is not None:
+        list_kwargs['filters'] = {'name': name}
+    for arg, value in (('limit', limit), ('marker', marker),
+                       ('page_size', page_size)):
+        if value is not None:
+            list_kwargs[arg] = value
+    for image in g_client.images.list(**list_kwargs):
+        _add_image(ret, image)
+    log.debug('Returning %d images', len(ret))
     return ret
 
 def _add_image(collection, image):
@@ -362,6 +623,7 @@ def _add_image(collection, image):
         raise TypeError(msg)
     return collection
 
+@_reauth_on_unauthorized
 def image_create(name, location=None, profile=None, visibility=None,
         container_format='bare', disk_format='raw', protected=None,
         copy_from=None, is_public=None):
@@ -445,6 +707,7 @@ def image_create(name, location=None, profile=None, visibility=None,
     image = g_client.images.create(name=name, **kwargs)
     return image_show(image.id, profile=profile)
 
+@_reauth_on_unauthorized
 def image_delete(id=None, name=None, profile=None):  # pylint: disable=C0103
     '''
     Delete an image (glance image-delete)
@@ -460,10 +723,7 @@ def image_delete(id=None, name=None, profile=None):  # pylint: disable=C0103
     g_client = _auth(profile)
     image = {'id': False, 'name': None}
     if name:
-        for image in g_client.images.list():
-            if image.name == name:
-                id = image.id  # pylint: disable=C0103
-                continue
+        id = _image_id_by_name(g_client, name)  # pylint: disable=C0103
     if not id:
         return {
             'result': False,
@@ -491,6 +751,7 @@ def image_delete(id=None, name=None, profile=None):  # pylint: disable=C0103
         'comment': 'Deleted image \'{0}\' ({1}).'.format(name, id),
         }
 
+@_reauth_on_unauthorized
 def image_show(id=None, name=None, profile=None):  # pylint: disable=C0103
     '''
     Return details about a specific image (glance image-show)
@@ -502,12 +763,8 @@ def image_show(id=None, name=None, profile=None):  # pylint: disable=C0103
         salt '*' glance.image_show
     '''
     g_client = _auth(profile)
-    ret = {}
     if name:
-        for image in g_client.images.list():
-            if image.name == name:
-                id = image.id  # pylint: disable=C0103
-                continue
+        id = _image_id_by_name(g_client, name)  # pylint: disable=C0103
     if not id:
         return {
             'result': False,
@@ -522,17 +779,13 @@ def image_show(id=None, name=None, profile=None):  # pylint: disable=C0103
             'result': False,
             'comment': 'No image with ID {0}'.format(id)
             }
-    pformat = pprint.PrettyPrinter(indent=4).pformat
-    log.debug('Properties of image {0}:\n{1}'.format(
-        image.name, pformat(image)))
-    schema = image_schema(profile=profile)
-    if len(schema.keys()) == 1:
-        schema = schema['image']
-    for key in schema.keys():
-        if key in image:
-            ret[key] = image[key]
-    return ret
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Image %s: %s', id, _summary(
+            image, ('name', 'status', 'size', 'visibility')))
+    keys = _schema('image', profile)[1]
+    return _project(image, keys)
 
+@_reauth_on_unauthorized
 def image_update(id=None, name=None, profile=None, **kwargs):  # pylint: disable=C0103
     '''
     Update properties of given image.
@@ -584,6 +837,7 @@ def image_update(id=None, name=None, profile=None, **kwargs):  # pylint: disable
     updated = g_client.images.update(image['id'], **to_update)
     return updated
 
+@_reauth_on_unauthorized
 def _item_list(profile=None):
     '''
     Template for writing list functions
@@ -1,35 +1,171 @@
+import importlib
+import os
+import sys
+import threading
 try:
-    import os_client_config
-    from keystoneauth1 import exceptions as ka_exceptions
-    REQUIREMENTS_MET = True
+    from importlib.util import find_spec
 except ImportError:
-    REQUIREMENTS_MET = False
-
-from glancev2 import image
-from glancev2 import task
-
-image_create = image.image_create
-image_delete = image.image_delete
-image_deactivate = image.image_deactivate
-image_reactivate = image.image_reactivate
-image_list = image.image_list
-image_update = image.image_update
-image_download = image.image_data_download
-image_get_details = image.image_get_details
-task_list = task.task_list
-task_create = task.task_create
-task_show = task.task_show
+    import imp
+    find_spec = None
+
+# Packages needed by the submodules. They are only looked up here, the
+# submodules and with them these packages are imported on first use.
+REQUIREMENTS = ('os_client_config', 'keystoneauth1', 'requests')
+
+_CONFIGURED = False
+# The Salt loader puts the module directory on sys.path only while it
+# loads this package, keep it to import the submodules later on
+_MODULE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_IMPORT_LOCK = threading.RLock()
+# Imported together before the first call, pool threads of the calls
+# must not see a partially initialized submodule
+SUBMODULES = ('common', 'image', 'task', 'executor', 'metrics')
+
+
+def _importable(name):
+    if find_spec is not None:
+        return find_spec(name) is not None
+    try:
+        imp.find_module(name)
+    except ImportError:
+        return False
+    return True
+
+
+def _import(module_name):
+    name = 'glancev2.' + module_name
+    with _IMPORT_LOCK:
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        added = _MODULE_DIR not in sys.path
+        if added:
+            sys.path.insert(0, _MODULE_DIR)
+        try:
+            return importlib.import_module(name)
+        finally:
+            if added:
+                sys.path.remove(_MODULE_DIR)
+
+
+def _client_pillar():
+    # __pillar__ is missing when imported outside of the Salt loader
+    pillar = globals().get('__pillar__') or {}
+    return pillar.get('glance', {}).get('client', {})
+
+
+def _configure():
+    # Apply the pillar settings once, before the first request
+    global _CONFIGURED
+    if _CONFIGURED:
+        return
+    with _IMPORT_LOCK:
+        if _CONFIGURED:
+            return
+        for module_name in SUBMODULES:
+            _import(module_name)
+        common = _import('common')
+        client = _client_pillar()
+        common.POOL_SETTINGS.update(client.get('connection_pool', {}))
+        common.RESPONSE_CACHE.maxbytes = int(
+            client.get('response_cache_size', 0))
+        _CONFIGURED = True
+
+
+# Docstrings only, imported right away for sys.doc
+_docs = _import('docs')
+
+
+def _lazy(module_name, func_name, doc=None):
+    """Return a function calling func_name of a lazily imported submodule
+
+    The docstring is passed from glancev2.docs as sys.doc does not import
+    the submodule.
+    """
+    def wrapped_f(*args, **kwargs):
+        # Remove salt internal kwargs
+        for k in [k for k in kwargs if k.startswith('__')]:
+            kwargs.pop(k)
+        _configure()
+        module = _import(module_name)
+        return getattr(module, func_name)(*args, **kwargs)
+    wrapped_f.__name__ = func_name
+    wrapped_f.__doc__ = doc
+    return wrapped_f
+
+
+image_create = _lazy('image', 'image_create')
+image_delete = _lazy('image', 'image_delete')
+image_deactivate = _lazy('image', 'image_deactivate')
+image_reactivate = _lazy('image', 'image_reactivate')
+image_list = _lazy('image', 'image_list', _docs.IMAGE_LIST)
+image_update = _lazy('image', 'image_update')
+image_download = _lazy('image', 'image_data_download',
+                       _docs.IMAGE_DATA_DOWNLOAD)
+image_upload = _lazy('image', 'image_data_upload', _docs.IMAGE_DATA_UPLOAD)
+image_get_details = _lazy('image', 'image_get_details')
+task_list = _lazy('task', 'task_list')
+task_create = _lazy('task', 'task_create')
+task_show = _lazy('task', 'task_show')
+task_wait = _lazy('task', 'task_wait', _docs.TASK_WAIT)
+tasks_wait = _lazy('task', 'tasks_wait', _docs.TASKS_WAIT)
+client_evict = _lazy('common', 'evict_raw_client', _docs.EVICT_RAW_CLIENT)
 
 __all__ = (
     'image_update', 'image_create', 'image_list', 'image_delete', 'task_show',
-    'image_download', 'task_create', 'task_list', 'image_get_details',
-    'image_deactivate', 'image_reactivate'
+    'image_download', 'image_upload', 'task_create', 'task_list',
+    'image_get_details', 'image_deactivate', 'image_reactivate',
+    'client_evict', 'task_wait', 'tasks_wait', 'batch', 'stats'
 )
 
 
+def batch(calls, cloud_name=None, workers=None, timeout=None, **kwargs):
+    """Run several glancev2 calls concurrently
+
+    Calls share the cached authenticated adapter of their cloud. A failing
+    or timed out call does not stop the others.
+
+    :param calls: list of ``[function, kwargs]`` pairs, e.g.
+                  ``[['image_deactivate', {'name': 'cirros'}]]``
+    :param cloud_name: cloud used by calls not giving their own
+    :param workers: number of concurrent calls, 8 by default
+    :param timeout: (optional) seconds each call may take once started,
+                    also the HTTP timeout of its requests
+    :return: list of ``{'result': ...}`` or ``{'error': ...}`` in call order
+    """
+    _configure()
+    executor = _import('executor')
+    functions = dict((name, globals()[name]) for name in __all__
+                     if name not in ('batch', 'stats'))
+    return executor.run(calls, functions,
+                        workers=workers or executor.DEFAULT_WORKERS,
+                        timeout=timeout, cloud_name=cloud_name)
+
+
+def stats(textfile=None, reset=False, **kwargs):
+    """Return request statistics of the glancev2 functions in this process
+
+    Latency histograms, status codes and transferred bytes are kept per
+    method and endpoint, authentication time per cloud.
+
+    :param textfile: (optional) also write the statistics to this file in
+                     the Prometheus text format, defaults to the
+                     ``glance:client:metrics_textfile`` pillar
+    :param reset: clear the statistics after reading them
+    """
+    metrics = _import('metrics')
+    result = metrics.snapshot()
+    if reset:
+        metrics.reset()
+    textfile = textfile or _client_pillar().get('metrics_textfile')
+    if textfile:
+        metrics.write_textfile(textfile, result)
+    return result
+
+
 def __virtual__():
     """Only load glanceng if requirements are available."""
-    if REQUIREMENTS_MET:
+    if all(_importable(name) for name in REQUIREMENTS):
         return 'glancev2'
     else:
         return False, ("The glanceng execution module cannot be loaded: "
@@ -0,0 +1,146 @@
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+
+log = logging.getLogger(__name__)
+
+# FICLONE ioctl request number on Linux
+FICLONE = 0x40049409
+INDEX_FILE = 'index.json'
+LOCK_FILE = '.lock'
+
+
+def cache_key(image):
+    """Content address of the image data, prefers the image multihash"""
+    if image.get('os_hash_algo') and image.get('os_hash_value'):
+        return '{}-{}'.format(image['os_hash_algo'], image['os_hash_value'])
+    if image.get('checksum'):
+        return 'md5-{}'.format(image['checksum'])
+    return None
+
+
+def _reflink(src, dst):
+    # O_EXCL so that an existing link to the cached data is never truncated
+    fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    with open(src, 'rb') as s, os.fdopen(fd, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place(src, dst):
+    """Make dst have the content of src with the cheapest available method
+
+    Tries a reflink and falls back to a copy. The data is never shared
+    through a hardlink, which writes to dst would change.
+    """
+    tmp = '{}.{}.tmp'.format(dst, os.getpid())
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    for method in (_reflink, shutil.copyfile):
+        try:
+            method(src, tmp)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            continue
+        os.rename(tmp, dst)
+        return method
+    raise IOError(errno.EIO, 'Unable to place {} at {}'.format(src, dst))
+
+
+class ImageCache(object):
+    """Image data stored by content address with an LRU byte quota
+
+    Entries are tracked in ``index.json`` with their size and last access
+    time. All index updates are done under an exclusive file lock.
+    """
+
+    def __init__(self, directory, quota=None):
+        self.directory = directory
+        self.quota = int(quota) if quota else None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _lock(self):
+        f = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            index = {}
+        # Drop entries whose data vanished
+        return dict((k, v) for k, v in index.items()
+                    if os.path.exists(self.path(k)))
+
+    def _write_index(self, index):
+        name = os.path.join(self.directory, INDEX_FILE)
+        with open(name + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.rename(name + '.tmp', name)
+
+    def get(self, key, size=None):
+        """Return the path of a cached entry and mark it as recently used
+
+        An entry whose data no longer has the recorded size, or ``size``
+        if given, is dropped.
+        """
+        lock = self._lock()
+        try:
+            index = self._read_index()
+            if key not in index:
+                return None
+            actual = os.path.getsize(self.path(key))
+            if actual != index[key]['size'] or (
+                    size is not None and actual != size):
+                log.warning('Dropping image cache entry {} of unexpected '
+                            'size {}'.format(key, actual))
+                os.unlink(self.path(key))
+                del index[key]
+                self._write_index(index)
+                return None
+            index[key]['last_access'] = time.time()
+            self._write_index(index)
+            return self.path(key)
+        finally:
+            lock.close()
+
+    def add(self, key, file_name):
+        """Move a verified file into the cache and evict over the quota"""
+        lock = self._lock()
+        try:
+            os.rename(file_name, self.path(key))
+            index = self._read_index()
+            index[key] = {'size': os.path.getsize(self.path(key)),
+                          'last_access': time.time()}
+            self._evict(index, keep=key)
+            self._write_index(index)
+            return self.path(key)
+        finally:
+            lock.close()
+
+    def _evict(self, index, keep):
+        if self.quota is None:
+            return
+        total = sum(e['size'] for e in index.values())
+        lru = sorted(index, key=lambda k: index[k]['last_access'])
+        for key in lru:
+            if total <= self.quota:
+                break
+            if key == keep:
+                continue
+            log.debug('Evicting {} from image cache'.format(key))
+            try:
+                os.unlink(self.path(key))
+            except OSError:
+                pass
+            total -= index.pop(key)['size']
@@ -1,9 +1,48 @@
+import collections
+import copy
+import datetime
 import logging
 import os_client_config
+import random
+import requests
+import threading
+import time
+from keystoneauth1 import exceptions as ka_exceptions
+from keystoneauth1 import session as ka_session
 from uuid import UUID
 
+from glancev2 import docs
+from glancev2 import metrics
+
 log = logging.getLogger(__name__)
 
+# Authenticated adapters shared by all calls in this process, keyed by
+# cloud name. Each entry holds the adapter and its token expiry time.
+_ADAPTERS = {}
+_ADAPTERS_LOCK = threading.Lock()
+# Rebuild the adapter when its token expires in less than this many seconds
+TOKEN_EXPIRY_MARGIN = 120
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# HTTP connection pool settings, overridden by the glance:client:
+# connection_pool pillar and per cloud by the glance_connection_pool key
+# of the cloud in clouds.yaml
+POOL_SETTINGS = {
+    # Number of per host pools kept
+    'pool_connections': 10,
+    # Connections kept open per host
+    'pool_maxsize': 10,
+    # Wait for a free connection instead of opening an extra one
+    'pool_block': False,
+    # Reuse connections, and so their TLS sessions, between requests
+    'keep_alive': True,
+    # Enable TCP keepalive probes on pooled connections
+    'tcp_keepalive': True,
+}
+# requests sessions shared by all adapters, keyed by pool settings
+_HTTP_SESSIONS = {}
+
 
 class GlanceException(Exception):
 
@@ -42,14 +81,48 @@ class MultipleResourcesFound(GlanceException):
             self._msg.format(resource=resource, name=name))
 
 
-def get_raw_client(cloud_name):
+def _token_expires_soon(expires):
+    if expires is None:
+        return False
+    now = datetime.datetime.now(expires.tzinfo)
+    return (expires - now).total_seconds() < TOKEN_EXPIRY_MARGIN
+
+
+def _http_session(settings):
+    """Return the requests session shared by adapters using the settings"""
+    key = tuple(sorted(settings.items()))
+    if key in _HTTP_SESSIONS:
+        return _HTTP_SESSIONS[key]
+    if settings['tcp_keepalive']:
+        adapter_cls = ka_session.TCPKeepAliveAdapter
+    else:
+        adapter_cls = requests.adapters.HTTPAdapter
+    http_session = requests.Session()
+    for scheme in ('http://', 'https://'):
+        http_session.mount(scheme, adapter_cls(
+            pool_connections=int(settings['pool_connections']),
+            pool_maxsize=int(settings['pool_maxsize']),
+            pool_block=bool(settings['pool_block']),
+        ))
+    if not settings['keep_alive']:
+        http_session.headers['Connection'] = 'close'
+    _HTTP_SESSIONS[key] = http_session
+    return http_session
+
+
+def _build_raw_client(cloud_name):
     service_type = 'image'
     config = os_client_config.OpenStackConfig()
     cloud = config.get_one_cloud(cloud_name)
     adapter = cloud.get_session_client(service_type)
     adapter.version = '2'
+    settings = dict(POOL_SETTINGS)
+    settings.update(cloud.config.get('glance_connection_pool') or {})
+    adapter.session.session = _http_session(settings)
     try:
+        started = _monotonic()
         access_info = adapter.session.auth.get_access(adapter.session)
+        metrics.record_auth(cloud_name, _monotonic() - started)
         endpoints = access_info.service_catalog.get_endpoints()
     except (AttributeError, ValueError) as exc:
         log.exception('%s' % exc)
@@ -61,10 +134,175 @@ def get_raw_client(cloud_name):
             e = NoGlanceEndpoint()
             log.error('%s' % e)
             raise e
-    return adapter
+    return adapter, access_info.expires
+
+
+class Backoff(object):
+    """Exponential backoff with jitter bound by a monotonic deadline
+
+    :param timeout: seconds until the deadline
+    :param interval: first delay between polls
+    :param max_interval: upper bound of the delay between polls
+    :param factor: multiplier applied to the delay after each poll
+    :param jitter: relative random spread applied to each delay
+    """
+
+    def __init__(self, timeout, interval=0.5, max_interval=10, factor=2,
+                 jitter=0.2):
+        self.deadline = _monotonic() + float(timeout)
+        self.interval = float(interval)
+        self.max_interval = float(max_interval)
+        self.factor = factor
+        self.jitter = jitter
+
+    def remaining(self):
+        return max(0.0, self.deadline - _monotonic())
+
+    def sleep(self):
+        """Sleep before the next poll, return False once past the deadline"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            return False
+        delay = self.interval * random.uniform(1 - self.jitter,
+                                               1 + self.jitter)
+        time.sleep(min(delay, remaining))
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return True
+
+
+def wait_for(fetch, ready, backoff):
+    """Poll ``fetch`` until ``ready`` accepts its result or time runs out
+
+    Returns the last fetched resource, the caller checks whether it is in
+    the wanted state.
+    """
+    while True:
+        resource = fetch()
+        if ready(resource) or not backoff.sleep():
+            return resource
+
+
+def get_raw_client(cloud_name):
+    """Return an authenticated adapter for the cloud, reusing a cached one
+
+    The adapter and its session are kept until the token is about to
+    expire or the entry is dropped with :func:`evict_raw_client`.
+    """
+    with _ADAPTERS_LOCK:
+        cached = _ADAPTERS.get(cloud_name)
+        if cached is not None and not _token_expires_soon(cached[1]):
+            return cached[0]
+        adapter, expires = _build_raw_client(cloud_name)
+        _ADAPTERS[cloud_name] = (adapter, expires)
+        return adapter
+
+
+def evict_raw_client(cloud_name=None):
+    with _ADAPTERS_LOCK:
+        if cloud_name is None:
+            _ADAPTERS.clear()
+        else:
+            _ADAPTERS.pop(cloud_name, None)
+
+
+evict_raw_client.__doc__ = docs.EVICT_RAW_CLIENT
+
+
+class ResponseCache(object):
+    """LRU store of GET responses bound by the total size of their bodies
+
+    Only responses carrying an ``ETag`` or ``Last-Modified`` header are
+    kept, they are revalidated with conditional requests.
+    """
+
+    def __init__(self, maxbytes=0):
+        self.maxbytes = maxbytes
+        self.size = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._data[key] = entry
+            return entry
 
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
 
-def send(method):
+    def store(self, key, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        size = len(response.content)
+        if not (etag or last_modified) or size > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old['size']
+            self._data[key] = {'etag': etag, 'last_modified': last_modified,
+                               'body': response.json(), 'size': size}
+            self.size += size
+            while self.size > self.maxbytes:
+                self.size -= self._data.popitem(last=False)[1]['size']
+
+    def invalidate(self, cloud_name, url):
+        """Drop the entries of the resource at url and of its parents"""
+        with self._lock:
+            for key in [k for k in self._data
+                        if k[0] == cloud_name and url.startswith(k[1])]:
+                self.size -= self._data.pop(key)['size']
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+# Conditional GET cache of send('get', conditional=True) functions, keyed
+# by (cloud_name, url). Disabled until RESPONSE_CACHE.maxbytes is set.
+RESPONSE_CACHE = ResponseCache()
+
+
+# Per thread HTTP timeout of the requests, set by glancev2.batch for the
+# calls it runs
+_THREAD_OPTIONS = threading.local()
+
+
+def set_request_timeout(timeout):
+    """Set the HTTP timeout of requests sent from the calling thread"""
+    _THREAD_OPTIONS.timeout = timeout
+
+
+def _request(adapter, method, url, request_kwargs):
+    """Send a request through the adapter and record its statistics"""
+    timeout = getattr(_THREAD_OPTIONS, 'timeout', None)
+    if timeout is not None and 'timeout' not in request_kwargs:
+        request_kwargs = dict(request_kwargs, timeout=timeout)
+    started = _monotonic()
+    try:
+        response = getattr(adapter, method)(url, **request_kwargs)
+    except ka_exceptions.HttpError as e:
+        metrics.record_request(method, url, e.http_status,
+                               _monotonic() - started)
+        raise
+    request = getattr(response, 'request', None)
+    body = getattr(request, 'body', None)
+    metrics.record_request(
+        method, url, response.status_code, _monotonic() - started,
+        bytes_sent=len(body) if isinstance(body, (bytes, str)) else 0,
+        bytes_received=len(response.content or b''),
+    )
+    return response
+
+
+def send(method, conditional=False):
     def wrap(func):
         def wrapped_f(*args, **kwargs):
             cloud_name = kwargs.pop('cloud_name')
@@ -79,14 +317,82 @@ def send(method):
                 if k.startswith('__'):
                     kwargs.pop(k)
             url, request_kwargs = func(*args, **kwargs)
-            response = getattr(adapter, method)(url, **request_kwargs)
+            cached = None
+            if method != 'get':
+                RESPONSE_CACHE.invalidate(cloud_name, url)
+            elif conditional and RESPONSE_CACHE.maxbytes:
+                cached = RESPONSE_CACHE.get((cloud_name, url))
+                if cached is not None:
+                    headers = dict(request_kwargs.get('headers') or {})
+                    headers.update(RESPONSE_CACHE.conditional_headers(cached))
+                    request_kwargs['headers'] = headers
+            try:
+                response = _request(adapter, method, url, request_kwargs)
+            except ka_exceptions.Unauthorized:
+                # The cached token may have been revoked, retry once
+                # with a freshly authenticated adapter
+                evict_raw_client(cloud_name)
+                adapter = get_raw_client(cloud_name)
+                response = _request(adapter, method, url, request_kwargs)
+            if cached is not None and response.status_code == 304:
+                return copy.deepcopy(cached['body'])
             if not response.content:
                 return {}
+            if conditional and RESPONSE_CACHE.maxbytes:
+                RESPONSE_CACHE.store((cloud_name, url), response)
             return response.json()
         return wrapped_f
     return wrap
 
 
+class TTLCache(object):
+    """Thread safe mapping with per entry expiry and LRU eviction"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < _monotonic():
+                return default
+            # Re-insert to mark the entry as most recently used
+            self._data[key] = item
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, _monotonic() + self.ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item is not None else None
+
+    def discard_value(self, value):
+        with self._lock:
+            for key in [k for k, v in self._data.items() if v[0] == value]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Name to UUID resolutions done by get_by_name_or_uuid, keyed by
+# (cloud_name, resource, name)
+RESOLUTION_CACHE = TTLCache(maxsize=1024, ttl=60)
+
+
 def _check_uuid(val):
     try:
         return str(UUID(val)).replace('-', '') == val.replace('-', '')
@@ -108,13 +414,35 @@ def get_by_name_or_uuid(resource_list, resp_key):
             else:
                 # Then we have name not uuid
                 cloud_name = kwargs['cloud_name']
-                resp = resource_list(
-                    name=ref, cloud_name=cloud_name)[resp_key]
-                if len(resp) == 0:
-                    raise ResourceNotFound(resp_key, ref)
-                elif len(resp) > 1:
-                    raise MultipleResourcesFound(resp_key, ref)
-                uuid = resp[0]['id']
+                cache_key = (cloud_name, resp_key, ref)
+                uuid = RESOLUTION_CACHE.get(cache_key)
+                if uuid is None:
+                    resp = resource_list(
+                        name=ref, cloud_name=cloud_name)[resp_key]
+                    if len(resp) == 0:
+                        raise ResourceNotFound(resp_key, ref)
+                    elif len(resp) > 1:
+                        raise MultipleResourcesFound(resp_key, ref)
+                    uuid = resp[0]['id']
+                    RESOLUTION_CACHE.set(cache_key, uuid)
             return func(uuid, *args[start_arg:], **kwargs)
         return wrapped_f
     return wrap
+
+
+def forget_resolution(resp_key):
+    """Drop cached name resolutions of the resource the call changes
+
+    The wrapped function gets either the resource uuid as first argument
+    or a new resource definition with a ``name`` key.
+    """
+    def wrap(func):
+        def wrapped_f(*args, **kwargs):
+            cloud_name = kwargs.get('cloud_name')
+            if 'name' in kwargs:
+                RESOLUTION_CACHE.pop((cloud_name, resp_key, kwargs['name']))
+            if args:
+                RESOLUTION_CACHE.discard_value(args[0])
+            return func(*args, **kwargs)
+        return wrapped_f
+    return wrap
@@ -0,0 +1,55 @@
+# Docstrings of the glancev2 functions, shared by the submodules and the
+# lazy wrappers of the package that sys.doc reads without importing them
+
+IMAGE_LIST = """List images, following pagination until the catalog is exhausted
+
+    :param as_generator: return a lazy generator of images instead of
+                         the ``{'images': [...]}`` dictionary
+    :param page_size: number of images requested per page
+    :param limit: (optional) maximum number of images to return
+    :param marker: (optional) ID of the image after which to start
+    """
+
+IMAGE_DATA_DOWNLOAD = """Download image data to a local file
+
+    :param parallel: number of concurrent byte ranges to fetch, with more
+                     than one the download resumes after an interruption
+    :param hash_algos: list of hashlib algorithms to verify the data with,
+                       ``os_hash`` stands for the image ``os_hash_algo``.
+                       Defaults to md5.
+    :param cache_dir: (optional) directory keeping verified image data by
+                      checksum, a cached image is placed at ``file_name``
+                      without downloading it again as a reflink or a
+                      copy of the cached data.
+    :param cache_quota: (optional) size of the cache in bytes, least
+                        recently used images are evicted above it
+    :return: True if all digests of the downloaded data match
+    """
+
+IMAGE_DATA_UPLOAD = """Stream a local file to the image data of an image
+
+    :return: dictionary with the md5 checksum and size of the sent data
+    """
+
+TASK_WAIT = """Poll a task with backoff until it finishes or the timeout passes
+
+    :param task_id: ID of the task
+    :param timeout: seconds to wait for the task
+    :param interval: first delay between polls
+    :param max_interval: upper bound of the delay between polls
+    :return: last known task definition
+    """
+
+TASKS_WAIT = """Poll several tasks together until all finish or the timeout passes
+
+    Tasks that cannot be fetched map to None.
+
+    :param task_ids: IDs of the tasks
+    :param timeout: seconds to wait for all the tasks
+    :param interval: first delay between polls
+    :param max_interval: upper bound of the delay between polls
+    :param workers: number of concurrent requests
+    :return: dict of task ID to last known task definition
+    """
+
+EVICT_RAW_CLIENT = """Drop the cached adapter for the cloud, or all of them if not given"""
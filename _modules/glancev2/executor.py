@@ -0,0 +1,120 @@
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from glancev2.common import get_raw_client, set_request_timeout, \
+    _monotonic, GlanceException
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+class CallTimeout(GlanceException):
+    _msg = "Call did not finish in {timeout} seconds."
+
+    def __init__(self, timeout, **kwargs):
+        super(GlanceException, self).__init__(
+            self._msg.format(timeout=timeout))
+
+
+class _Call(object):
+
+    def __init__(self, func, kwargs, timeout=None):
+        self.func = func
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.cancelled = False
+        self.started_at = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        if self.cancelled:
+            return
+        self.started_at = _monotonic()
+        self.started.set()
+        # Requests of a stalled connection fail instead of hanging
+        set_request_timeout(self.timeout)
+        try:
+            self.result = self.func(**self.kwargs)
+        except Exception as e:
+            self.error = e
+        finally:
+            set_request_timeout(None)
+            self.done.set()
+
+    def wait(self, deadline=None):
+        """Wait for the call, the timeout counts from when it started
+
+        A call not started before ``deadline``, as the workers are stuck
+        on other calls, is cancelled and times out as well.
+        """
+        if self.timeout is None:
+            self.done.wait()
+        else:
+            if not self.started.wait(max(0, deadline - _monotonic())):
+                self.cancelled = True
+            # The call may have started right before it was cancelled
+            if self.started.is_set():
+                remaining = self.started_at + self.timeout - _monotonic()
+                self.done.wait(max(0, remaining))
+        if not self.done.is_set():
+            return {'error': '{}'.format(CallTimeout(self.timeout))}
+        if self.error is not None:
+            return {'error': '{}: {}'.format(type(self.error).__name__,
+                                             self.error)}
+        return {'result': self.result}
+
+
+def _parse_call(call):
+    if isinstance(call, dict):
+        return call['function'], dict(call.get('kwargs') or {})
+    function, kwargs = call
+    return function, dict(kwargs or {})
+
+
+def run(calls, functions, workers=DEFAULT_WORKERS, timeout=None,
+        cloud_name=None):
+    """Run calls concurrently and return their outcomes in order
+
+    :param calls: list of ``(function, kwargs)`` pairs or of dicts with
+                  ``function`` and ``kwargs`` keys
+    :param functions: dict of the callable functions by name
+    :param workers: number of concurrent calls
+    :param timeout: (optional) seconds each call may take once started,
+                    also the HTTP timeout of its requests. Calls not
+                    started once every worker could have run its share
+                    of the calls time out too.
+    :param cloud_name: cloud used by calls not giving their own
+    :return: list of ``{'result': ...}`` or ``{'error': ...}`` dicts
+    """
+    pending = []
+    for call in calls:
+        function, kwargs = _parse_call(call)
+        if function not in functions:
+            raise GlanceException(
+                'Unknown glancev2 function: {}'.format(function))
+        if cloud_name is not None:
+            kwargs.setdefault('cloud_name', cloud_name)
+        pending.append(_Call(functions[function], kwargs, timeout))
+
+    # Authenticate once before the workers share the cached adapter
+    for name in set(c.kwargs.get('cloud_name') for c in pending):
+        if name:
+            get_raw_client(name)
+
+    workers = max(1, min(int(workers), len(pending) or 1))
+    deadline = None
+    if timeout is not None:
+        rounds = -(-len(pending) // workers)
+        deadline = _monotonic() + float(timeout) * rounds
+    pool = ThreadPool(workers)
+    try:
+        for call in pending:
+            pool.apply_async(call.run)
+        return [call.wait(deadline) for call in pending]
+    finally:
+        pool.close()
@@ -1,20 +1,87 @@
 try:
-    from urllib.parse import urlencode
+    from urllib.parse import urlencode, urlparse, parse_qs
 except ImportError:
     from urllib import urlencode
+    from urlparse import urlparse, parse_qs
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import hashlib
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
 
-from glancev2.common import send, get_raw_client, get_by_name_or_uuid
+from glancev2 import cache
+from glancev2 import docs
+from glancev2 import metrics
+from glancev2.common import send, get_raw_client, get_by_name_or_uuid, \
+    forget_resolution, GlanceException, _monotonic
+
+log = logging.getLogger(__name__)
 
 RESOURCE_LIST_KEY = 'images'
+DEFAULT_PAGE_SIZE = 500
+CHUNK_SIZE = 1024 * 1024
 
 
 @send('get')
-def image_list(**kwargs):
+def _image_list_page(**kwargs):
     url = '/images?{}'.format(urlencode(kwargs))
     return url, {}
 
 
+def _next_marker(page):
+    next_link = page.get('next')
+    if not next_link:
+        return None
+    marker = parse_qs(urlparse(next_link).query).get('marker')
+    return marker[0] if marker else None
+
+
+def image_list_iter(page_size=DEFAULT_PAGE_SIZE, limit=None, **kwargs):
+    """Yield images page by page following the 'next' links
+
+    :param page_size: number of images requested per page
+    :param limit: (optional) maximum number of images to yield
+    :param marker: (optional) ID of the image after which to start
+    :param kwargs: filters passed to Glance as query parameters
+    """
+    marker = kwargs.pop('marker', None)
+    count = 0
+    while True:
+        size = page_size
+        if limit is not None:
+            size = min(int(page_size), int(limit) - count)
+            if size <= 0:
+                return
+        query = dict(kwargs, limit=size)
+        if marker:
+            query['marker'] = marker
+        page = _image_list_page(**query)
+        for image in page.get(RESOURCE_LIST_KEY, []):
+            yield image
+            count += 1
+            if limit is not None and count >= int(limit):
+                return
+        marker = _next_marker(page)
+        if not marker:
+            return
+
+
+def image_list(as_generator=False, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+    images = image_list_iter(page_size=page_size, **kwargs)
+    if as_generator:
+        return images
+    return {RESOURCE_LIST_KEY: list(images)}
+
+
+image_list.__doc__ = docs.IMAGE_LIST
+
+
+@forget_resolution(RESOURCE_LIST_KEY)
 @send('post')
 def image_create(**kwargs):
     url = '/images'
@@ -22,13 +89,14 @@ def image_create(**kwargs):
 
 
 @get_by_name_or_uuid(image_list, RESOURCE_LIST_KEY)
-@send('get')
+@send('get', conditional=True)
 def image_get_details(image_id, **kwargs):
     url = '/images/{}'.format(image_id)
     return url, {}
 
 
 @get_by_name_or_uuid(image_list, RESOURCE_LIST_KEY)
+@forget_resolution(RESOURCE_LIST_KEY)
 @send('patch')
 def image_update(image_id, properties, **kwargs):
     url = '/images/{}'.format(image_id)
@@ -39,6 +107,7 @@ def image_update(image_id, properties, **kwargs):
 
 
 @get_by_name_or_uuid(image_list, RESOURCE_LIST_KEY)
+@forget_resolution(RESOURCE_LIST_KEY)
 @send('delete')
 def image_delete(image_id, **kwargs):
     url = '/images/{}'.format(image_id)
@@ -59,10 +128,66 @@ def image_reactivate(image_id, **kwargs):
     return url, {}
 
 
+class BackgroundHasher(object):
+    """Compute several digests of a stream in a worker thread
+
+    Chunks go through a bounded queue so the reader only blocks when
+    hashing falls behind by ``maxsize`` chunks.
+    """
+
+    def __init__(self, algorithms, maxsize=16):
+        self.hashers = dict((a, hashlib.new(a)) for a in set(algorithms))
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            for hasher in self.hashers.values():
+                hasher.update(chunk)
+
+    def update(self, chunk):
+        self._queue.put(chunk)
+
+    def close(self):
+        """Stop the worker thread, also when the stream is abandoned"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def hexdigests(self):
+        self.close()
+        return dict((a, h.hexdigest()) for a, h in self.hashers.items())
+
+
+def _expected_digests(image, md5=None):
+    expected = {}
+    if md5 or image.get('checksum'):
+        expected['md5'] = md5 or image['checksum']
+    if image.get('os_hash_algo') and image.get('os_hash_value'):
+        expected[image['os_hash_algo']] = image['os_hash_value']
+    return expected
+
+
+def _verify_digests(digests, expected):
+    for algo, digest in digests.items():
+        if algo not in expected:
+            log.error('No {} digest is known for the image'.format(algo))
+            return False
+        if digest != expected[algo]:
+            log.error('Image data {} digest mismatch: {} != {}'.format(
+                algo, digest, expected[algo]))
+            return False
+    return True
+
+
 class StreamingDownloader(object):
 
-    def __init__(self, adapter, image_id, chunksize):
-        self.hasher = hashlib.new('md5')
+    def __init__(self, adapter, image_id, chunksize, algorithms=('md5',)):
         self.chunksize = chunksize
 
         resp = adapter.get('/images/{}/file'.format(image_id),
@@ -71,32 +196,247 @@ class StreamingDownloader(object):
             raise Exception('Invalid response code: %s' % resp.status_code)
 
         self._request = resp
+        self.hasher = BackgroundHasher(algorithms)
 
     def __iter__(self):
-        for chunk in self._request.iter_content(chunk_size=self.chunksize):
-            self.hasher.update(chunk)
-            yield chunk
+        try:
+            for chunk in self._request.iter_content(
+                    chunk_size=self.chunksize):
+                self.hasher.update(chunk)
+                yield chunk
+        finally:
+            self.hasher.close()
+
+    def validate(self, image=None):
+        expected = _expected_digests(
+            image or {}, self._request.headers.get('Content-Md5'))
+        return _verify_digests(self.hasher.hexdigests(), expected)
+
+
+class RangeDownloader(object):
+    """Fetch image data as concurrent byte ranges into a preallocated file
+
+    Progress of every range is kept in a ``<file_name>.part`` sidecar so
+    an interrupted download resumes where each range stopped. Digests of
+    the complete file are compared to the ``Content-Md5`` header, or to the
+    image checksum if the server does not send it for partial content, and
+    to the image multihash.
+    """
 
-    def validate(self):
-        return self.hasher.hexdigest() == self._request.headers['Content-Md5']
+    # Persist the progress of a range after this many bytes
+    SAVE_EVERY = 16 * CHUNK_SIZE
+
+    def __init__(self, adapter, image, file_name, parts, chunksize,
+                 algorithms=('md5',)):
+        self.adapter = adapter
+        self.image = image
+        self.image_id = image['id']
+        self.file_name = file_name
+        self.sidecar = file_name + '.part'
+        self.chunksize = chunksize
+        self.algorithms = algorithms
+        self._lock = threading.Lock()
+
+        self.size = image['size']
+        ranges = self._load_ranges()
+        # A sidecar left by another image or size is not resumed
+        self.resumed = ranges is not None
+        self.ranges = ranges if self.resumed else self._split(max(1, parts))
+
+    def _split(self, parts):
+        if not self.size:
+            return []
+        step = -(-self.size // parts)
+        return [[start, min(start + step, self.size) - 1, start]
+                for start in range(0, self.size, step)]
+
+    def _load_ranges(self):
+        try:
+            with open(self.sidecar) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if (state.get('image_id') != self.image_id or
+                state.get('size') != self.size or
+                not os.path.exists(self.file_name)):
+            return None
+        return state['ranges']
+
+    def _save_ranges(self):
+        with self._lock:
+            tmp = self.sidecar + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'image_id': self.image_id, 'size': self.size,
+                           'ranges': self.ranges}, f)
+            os.rename(tmp, self.sidecar)
+
+    def _preallocate(self):
+        mode = 'r+b' if os.path.exists(self.file_name) else 'wb'
+        with open(self.file_name, mode) as f:
+            f.truncate(self.size)
+            if hasattr(os, 'posix_fallocate') and self.size:
+                os.posix_fallocate(f.fileno(), 0, self.size)
+
+    def _fetch(self, part):
+        start, end, offset = part
+        if offset > end:
+            return None
+        headers = {'Range': 'bytes={}-{}'.format(offset, end)}
+        resp = self.adapter.get('/images/{}/file'.format(self.image_id),
+                                stream=True, headers=headers)
+        if resp.status_code != 206:
+            raise Exception('Invalid response code: %s' % resp.status_code)
+        unsaved = 0
+        with open(self.file_name, 'r+b') as f:
+            f.seek(offset)
+            for chunk in resp.iter_content(chunk_size=self.chunksize):
+                f.write(chunk)
+                part[2] += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= self.SAVE_EVERY:
+                    f.flush()
+                    self._save_ranges()
+                    unsaved = 0
+        return resp.headers.get('Content-Md5')
+
+    def download(self, workers):
+        if not self.resumed:
+            if os.path.exists(self.sidecar):
+                os.remove(self.sidecar)
+            self._preallocate()
+        self._save_ranges()
+        pool = ThreadPool(max(1, min(int(workers), len(self.ranges))))
+        try:
+            md5_headers = pool.map(self._fetch, self.ranges)
+        finally:
+            pool.close()
+            self._save_ranges()
+        hasher = BackgroundHasher(self.algorithms)
+        try:
+            with open(self.file_name, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunksize), b''):
+                    hasher.update(chunk)
+        finally:
+            hasher.close()
+        os.remove(self.sidecar)
+        expected = _expected_digests(
+            self.image, next((d for d in md5_headers if d), None))
+        return _verify_digests(hasher.hexdigests(), expected)
+
+
+def _hash_algorithms(hash_algos, image):
+    if not hash_algos:
+        return ['md5']
+    if not isinstance(hash_algos, (list, tuple)):
+        hash_algos = hash_algos.split(',')
+    algorithms = []
+    for algo in hash_algos:
+        if algo == 'os_hash':
+            if not image.get('os_hash_algo'):
+                raise GlanceException(
+                    'Image {} has no os_hash_algo.'.format(image['id']))
+            algo = image['os_hash_algo']
+        algorithms.append(algo)
+    return algorithms
+
+
+def _download(adapter, image, file_name, parallel, algorithms):
+    started = _monotonic()
+    # Data goes to a new file renamed over file_name, never through an
+    # existing file that may share its data with another one
+    partial = file_name + '.download'
+    if parallel > 1:
+        downloader = RangeDownloader(adapter, image, partial,
+                                     parallel, CHUNK_SIZE, algorithms)
+        valid = downloader.download(parallel)
+    else:
+        downloader = StreamingDownloader(adapter, image['id'], CHUNK_SIZE,
+                                         algorithms)
+        with open(partial, 'wb') as f:
+            try:
+                for chunk in downloader:
+                    f.write(chunk)
+            finally:
+                downloader.hasher.close()
+        valid = downloader.validate(image)
+    os.rename(partial, file_name)
+    metrics.record_request(
+        'get', '/images/{}/file'.format(image['id']), 200,
+        _monotonic() - started, bytes_received=os.path.getsize(file_name))
+    return valid
 
 
 @get_by_name_or_uuid(image_list, RESOURCE_LIST_KEY)
-def image_data_download(image_id, file_name, **kwargs):
+def image_data_download(image_id, file_name, parallel=1, hash_algos=None,
+                        cache_dir=None, cache_quota=None, **kwargs):
     cloud_name = kwargs.pop('cloud_name')
     adapter = get_raw_client(cloud_name)
-    downloader = StreamingDownloader(adapter, image_id, 1024 * 1024)
-    with open(file_name, 'wb') as f:
-        for chunk in downloader:
-            f.write(chunk)
-    return downloader.validate()
+    parallel = int(parallel)
+    image = {'id': image_id}
+    if parallel > 1 or cache_dir or (hash_algos and hash_algos != ['md5']):
+        image = adapter.get('/images/{}'.format(image_id)).json()
+    algorithms = _hash_algorithms(hash_algos, image)
+    key = cache.cache_key(image) if cache_dir else None
+    if not key:
+        return _download(adapter, image, file_name, parallel, algorithms)
+
+    image_cache = cache.ImageCache(cache_dir, cache_quota)
+    cached = image_cache.get(key, image.get('size'))
+    if cached is None:
+        partial = image_cache.path(key) + '.download'
+        if not _download(adapter, image, partial, parallel, algorithms):
+            os.remove(partial)
+            return False
+        cached = image_cache.add(key, partial)
+    else:
+        log.debug('Image {} found in cache {}'.format(image_id, cached))
+    cache.place(cached, file_name)
+    return True
+
+
+image_data_download.__doc__ = docs.IMAGE_DATA_DOWNLOAD
+
+
+class StreamingUploader(object):
+    """Iterable over fixed size file chunks hashing the data as it is read
+
+    Having no length, it makes requests use chunked transfer encoding.
+    """
+
+    def __init__(self, file_name, chunksize):
+        self.file_name = file_name
+        self.chunksize = chunksize
+        self.hasher = hashlib.new('md5')
+        self.size = 0
+
+    def __iter__(self):
+        with open(self.file_name, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunksize)
+                if not chunk:
+                    break
+                self.hasher.update(chunk)
+                self.size += len(chunk)
+                yield chunk
+
+    def checksum(self):
+        return self.hasher.hexdigest()
 
 
 @get_by_name_or_uuid(image_list, RESOURCE_LIST_KEY)
-@send('put')
-def image_data_upload(image_id, file_name, **kwargs):
-    url = '/images/{}/file'.format(image_id)
-    headers = {'Content-Type': 'application/octet-stream '}
-    with open(file_name, 'rb') as f:
-        data = f.readlines()
-    return url, {'json': data, 'headers': headers}
+def image_data_upload(image_id, file_name, chunksize=CHUNK_SIZE, **kwargs):
+    cloud_name = kwargs.pop('cloud_name')
+    adapter = get_raw_client(cloud_name)
+    uploader = StreamingUploader(file_name, int(chunksize))
+    started = _monotonic()
+    response = adapter.put(
+        '/images/{}/file'.format(image_id), data=uploader,
+        headers={'Content-Type': 'application/octet-stream'},
+    )
+    metrics.record_request(
+        'put', '/images/{}/file'.format(image_id), response.status_code,
+        _monotonic() - started, bytes_sent=uploader.size)
+    return {'checksum': uploader.checksum(), 'size': uploader.size}
+
+
+image_data_upload.__doc__ = docs.IMAGE_DATA_UPLOAD
@@ -0,0 +1,132 @@
+import os
+import re
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_UUID_RE = re.compile(
+    '[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}',
+    re.IGNORECASE)
+
+_lock = threading.Lock()
+_requests = {}
+_auth = {}
+
+
+def endpoint(url):
+    """Normalise an url to an endpoint template, e.g. /images/{id}"""
+    return _UUID_RE.sub('{id}', url.split('?', 1)[0])
+
+
+def _histogram():
+    return {'count': 0, 'sum': 0.0, 'buckets': [0] * len(BUCKETS)}
+
+
+def _observe(histogram, seconds):
+    histogram['count'] += 1
+    histogram['sum'] += seconds
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+
+
+def record_request(method, url, status, seconds, bytes_sent=0,
+                   bytes_received=0):
+    key = (method.upper(), endpoint(url))
+    with _lock:
+        entry = _requests.get(key)
+        if entry is None:
+            entry = _requests[key] = {
+                'latency': _histogram(), 'status': {},
+                'bytes_sent': 0, 'bytes_received': 0,
+            }
+        _observe(entry['latency'], seconds)
+        status = str(status)
+        entry['status'][status] = entry['status'].get(status, 0) + 1
+        entry['bytes_sent'] += bytes_sent
+        entry['bytes_received'] += bytes_received
+
+
+def record_auth(cloud_name, seconds):
+    with _lock:
+        if cloud_name not in _auth:
+            _auth[cloud_name] = _histogram()
+        _observe(_auth[cloud_name], seconds)
+
+
+def snapshot():
+    """Return a copy of the collected statistics"""
+    with _lock:
+        requests = {}
+        for (method, url), entry in _requests.items():
+            requests['{} {}'.format(method, url)] = {
+                'latency': dict(entry['latency'],
+                                buckets=list(entry['latency']['buckets'])),
+                'status': dict(entry['status']),
+                'bytes_sent': entry['bytes_sent'],
+                'bytes_received': entry['bytes_received'],
+            }
+        auth = dict((cloud, dict(h, buckets=list(h['buckets'])))
+                    for cloud, h in _auth.items())
+    return {'buckets': list(BUCKETS), 'requests': requests, 'auth': auth}
+
+
+def reset():
+    with _lock:
+        _requests.clear()
+        _auth.clear()
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    for bound, count in zip(BUCKETS, histogram['buckets']):
+        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+            name, labels, bound, count))
+    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+        name, labels, histogram['count']))
+    lines.append('{}_sum{{{}}} {}'.format(name, labels, histogram['sum']))
+    lines.append('{}_count{{{}}} {}'.format(name, labels, histogram['count']))
+    return lines
+
+
+def prometheus(stats):
+    """Render statistics in the Prometheus text exposition format"""
+    lines = [
+        '# TYPE glancev2_request_duration_seconds histogram',
+    ]
+    for key in sorted(stats['requests']):
+        method, url = key.split(' ', 1)
+        labels = 'method="{}",endpoint="{}"'.format(method, url)
+        lines.extend(_histogram_lines('glancev2_request_duration_seconds',
+                                      labels,
+                                      stats['requests'][key]['latency']))
+    lines.append('# TYPE glancev2_requests_total counter')
+    for key in sorted(stats['requests']):
+        method, url = key.split(' ', 1)
+        for status, count in sorted(stats['requests'][key]['status'].items()):
+            lines.append('glancev2_requests_total{{method="{}",endpoint="{}",'
+                         'code="{}"}} {}'.format(method, url, status, count))
+    for direction in ('sent', 'received'):
+        lines.append('# TYPE glancev2_bytes_{}_total counter'.format(
+            direction))
+        for key in sorted(stats['requests']):
+            method, url = key.split(' ', 1)
+            lines.append('glancev2_bytes_{}_total{{method="{}",endpoint="{}"}}'
+                         ' {}'.format(direction, method, url,
+                                      stats['requests'][key]['bytes_' +
+                                                             direction]))
+    lines.append('# TYPE glancev2_auth_duration_seconds histogram')
+    for cloud in sorted(stats['auth']):
+        lines.extend(_histogram_lines('glancev2_auth_duration_seconds',
+                                      'cloud="{}"'.format(cloud),
+                                      stats['auth'][cloud]))
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, stats):
+    """Atomically write statistics for the node exporter textfile collector"""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(prometheus(stats))
+    os.rename(tmp, path)
@@ -2,7 +2,12 @@ try:
     from urllib.parse import urlencode
 except ImportError:
     from urllib import urlencode
-from glancev2.common import send
+from multiprocessing.pool import ThreadPool
+
+from glancev2 import docs
+from glancev2.common import send, Backoff, wait_for
+
+TASK_FINAL_STATUSES = ('success', 'failure')
 
 
 @send('post')
@@ -21,7 +26,49 @@ def task_list(**kwargs):
     return url, {}
 
 
-@send('get')
+@send('get', conditional=True)
 def task_show(task_id, **kwargs):
     url = '/tasks/{}'.format(task_id)
     return url, {}
+
+
+def task_wait(task_id, timeout=30, interval=0.5, max_interval=10, **kwargs):
+    cloud_name = kwargs['cloud_name']
+    return wait_for(
+        lambda: task_show(task_id, cloud_name=cloud_name),
+        lambda task: task['status'] in TASK_FINAL_STATUSES,
+        Backoff(timeout, interval, max_interval),
+    )
+
+
+task_wait.__doc__ = docs.TASK_WAIT
+
+
+def tasks_wait(task_ids, timeout=30, interval=0.5, max_interval=10,
+               workers=8, **kwargs):
+    cloud_name = kwargs['cloud_name']
+    backoff = Backoff(timeout, interval, max_interval)
+    tasks = {}
+    pending = list(task_ids)
+
+    def _show(task_id):
+        try:
+            return task_show(task_id, cloud_name=cloud_name)
+        except Exception:
+            return None
+
+    pool = ThreadPool(max(1, min(int(workers), len(pending) or 1)))
+    try:
+        while pending:
+            for task_id, task in zip(pending, pool.map(_show, pending)):
+                tasks[task_id] = task
+            pending = [t for t in pending if tasks[t] is not None and
+                       tasks[t]['status'] not in TASK_FINAL_STATUSES]
+            if pending and not backoff.sleep():
+                break
+    finally:
+        pool.close()
+    return tasks
+
+
+tasks_wait.__doc__ = docs.TASKS_WAIT
@@ -332,34 +332,25 @@ def image_import(name, profile=None, visibility='public', protected=False,
             }
 
         # Wait for the task to complete
-        timer = timeout
-        while timer > 0:
-            if 'status' in task and task['status'] == 'success':
-                log.debug('Task {0} has successfully completed'.format(
-                    task_id))
-                break
-            elif 'status' in task and task['status'] == 'failure':
-                msg = "Task {0} has failed".format(task_id)
+        if task.get('status') not in ('success', 'failure'):
+            task = __salt__['glanceng.task_wait'](
+                task_id, profile=profile, timeout=timeout)
+            if task is None:
                 ret['result'] = False
-                ret['comment'] = msg
+                ret['comment'] = 'Created task {0} vanished'.format(task_id)
                 return ret
-            else:
-                timer -= 5
-                time.sleep(5)
-                existing_tasks = __salt__['glanceng.task_list'](profile)
-                if task_id not in existing_tasks:
-                    ret['result'] = False
-                    ret['comment'] += 'Created task {0} '.format(
-                        task_id) + ' vanished:\n' + msg
-                    return ret
-                else:
-                    task = existing_tasks[task_id]
-        if timer <= 0 and task['status'] != 'success':
+        if task.get('status') == 'failure':
+            msg = "Task {0} has failed".format(task_id)
+            ret['result'] = False
+            ret['comment'] = msg
+            return ret
+        elif task.get('status') != 'success':
             ret['result'] = False
             ret['comment'] = ('Task {0} did not reach state success before '
                               'the timeout:\nLast status was '
-                              '"{1}".\n'.format(task_id, task['status']))
+                              '"{1}".\n'.format(task_id, task.get('status')))
             return ret
+        log.debug('Task {0} has successfully completed'.format(task_id))
 
         # The import task has successfully completed. Now, let's check that it
         # created the image.
@@ -5,7 +5,7 @@ Managing Images in OpenStack Glance
 '''
 # Import python libs
 import logging
-import time
+from multiprocessing.pool import ThreadPool
 
 
 # Import OpenStack libs
@@ -22,7 +22,7 @@ def _glancev2_call(fname, *args, **kwargs):
 
 def image_present(name, cloud_name, location, image_properties,
                   import_from_format='raw', timeout=30,
-                  sleep_time=5, checksum=None):
+                  sleep_time=5, checksum=None, remove_properties=False):
     """
     Creates a task to import an image
 
@@ -32,8 +32,10 @@ def image_present(name, cloud_name, location, image_properties,
     After the task is created, its status is monitored. On success the state
     would check that an image is present and return its ID.
 
-    Also, this state can update(add and replace) image properties,
-    but !!It can't delete properties, that are already in state
+    Also, this state updates image properties with a single minimal JSON
+    patch. Tags are compared as a set and read-only properties are
+    ignored. Custom properties missing from image_properties are only
+    removed if remove_properties is set.
 
     :param name: name of the image
     :param cloud_name: name of the cloud in cloud.yaml
@@ -48,147 +50,420 @@ def image_present(name, cloud_name, location, image_properties,
                               Valid values: public, private, community, shared
     :param import_from_format: (optional) Format to import the image from
     :param timeout: (optional) Time for task to download image
-    :param sleep_time: (optional) Timer countdown
+    :param sleep_time: (optional) Longest interval between task polls,
+                       polling starts sub-second and backs off up to it
     :param checksum: (optional) checksum of the image to verify it
+    :param remove_properties: (optional) remove custom properties of the
+                              image that are not in image_properties
     """
-    try:
-        exact_image = _glancev2_call(
-            'image_get_details', name=name, cloud_name=cloud_name
-        )
-    except Exception as e:
-        if 'ResourceNotFound' in repr(e):
-            image_properties['name'] = name
-            task_params = {"import_from": location,
-                           "import_from_format": import_from_format,
-                           "image_properties": image_properties
-                           }
-            # Try create task
+    images = _catalog_find(cloud_name, name)
+    if len(images) > 1:
+        return _find_failed(name, 'image')
+    if not images:
+        image_properties['name'] = name
+        task_params = {"import_from": location,
+                       "import_from_format": import_from_format,
+                       "image_properties": image_properties
+                       }
+        # Try create task
+        try:
+            task = _glancev2_call(
+                'task_create', task_type='import', task_input=task_params,
+                cloud_name=cloud_name
+            )
+        except Exception as e:
+            log.error(
+                'Glance image create failed on create task with {}'.format(
+                    e)
+            )
+            return _create_failed(name, 'image_task')
+        if task['status'] not in ('success', 'failure'):
             try:
                 task = _glancev2_call(
-                    'task_create', task_type='import', task_input=task_params,
-                    cloud_name=cloud_name
+                    'task_wait', task['id'], timeout=timeout,
+                    max_interval=sleep_time, cloud_name=cloud_name
                 )
             except Exception as e:
                 log.error(
-                    'Glance image create failed on create task with {}'.format(
-                        e)
+                    'Glance failed to check '
+                    'task status with {}'.format(e)
                 )
                 return _create_failed(name, 'image_task')
-            while timeout > 0:
-                if task['status'] == 'success':
-                    break
-                elif task['status'] == 'failure':
-                    log.error('Glance task failed to complete')
-                    return _create_failed(name, 'image')
-                else:
-                    timeout -= sleep_time
-                    time.sleep(sleep_time)
-                    # Check task status again
-                    try:
-                        task = _glancev2_call(
-                            'task_show', task_id=task['id'],
-                            cloud_name=cloud_name
-                        )
-                    except Exception as e:
-                        log.error(
-                            'Glance failed to check '
-                            'task status with {}'.format(e)
-                        )
-                        return _create_failed(name, 'image_task')
-            if timeout <= 0 and task['status'] != 'success':
-                log.error(
-                    'Glance task failed to import '
-                    'image for given amount of time'
-                )
-                return _create_failed(name, 'image')
-            # Task successfully finished
-            # and now check that is created the image
+        if task['status'] == 'failure':
+            log.error('Glance task failed to complete')
+            return _create_failed(name, 'image')
+        if task['status'] != 'success':
+            log.error(
+                'Glance task failed to import '
+                'image for given amount of time'
+            )
+            return _create_failed(name, 'image')
+        # Task successfully finished
+        # and now check that is created the image
 
+        image_id = (task.get('result') or {}).get('image_id')
+        if image_id:
+            image = _glancev2_call(
+                'image_get_details', image_id, cloud_name=cloud_name
+            )
+        else:
             image = _glancev2_call(
                 'image_list', name=name, cloud_name=cloud_name
             )['images'][0]
 
-            if not image:
-                return _create_failed(name, 'image')
-
-            resp = _created(name, 'image', image)
-
-            if checksum:
-                if image['status'] == 'active':
-                    if 'checksum' not in image:
-                        log.error(
-                            'Glance image. No checksum for image.'
-                            'Image status is active'
-                        )
-                        return _create_failed(name, 'image')
-                    if image['checksum'] != checksum:
-                        log.error(
-                            'Glance image create failed since '
-                            'image_checksum should be '
-                            '{} but it is {}'.format(checksum,
-                                                     image['checksum'])
-                        )
-                        return _create_failed(name, 'image')
-
-                elif image['status'] in ['saving', 'queued']:
-                    resp['comment'] = resp['comment'] \
-                                      + " checksum couldn't be verified, " \
-                                        "since status is not active"
-            return resp
-        elif 'MultipleResourcesFound' in repr(e):
-            return _find_failed(name, 'image')
-        else:
-            raise
+        if not image:
+            return _create_failed(name, 'image')
+        _catalog_put(cloud_name, image)
 
-    to_change = []
-    for prop in image_properties:
-        path = prop.replace('~', '~0').replace('/', '~1')
-        if prop in exact_image:
-            if exact_image[prop] != image_properties[prop]:
-                to_change.append({
-                    'op': 'replace',
-                    'path': '/{}'.format(path),
-                    'value': image_properties[prop]
-                })
-        else:
-            to_change.append({
-                'op': 'add',
-                'path': '/{}'.format(path),
-                'value': image_properties[prop]
-            })
+        resp = _created(name, 'image', image)
+
+        if checksum:
+            if image['status'] == 'active':
+                if 'checksum' not in image:
+                    log.error(
+                        'Glance image. No checksum for image.'
+                        'Image status is active'
+                    )
+                    return _create_failed(name, 'image')
+                if image['checksum'] != checksum:
+                    log.error(
+                        'Glance image create failed since '
+                        'image_checksum should be '
+                        '{} but it is {}'.format(checksum,
+                                                 image['checksum'])
+                    )
+                    return _create_failed(name, 'image')
+
+            elif image['status'] in ['saving', 'queued']:
+                resp['comment'] = resp['comment'] \
+                                  + " checksum couldn't be verified, " \
+                                    "since status is not active"
+        return resp
+
+    exact_image = images[0]
+    to_change = _image_patch(exact_image, image_properties,
+                             remove_properties)
     if to_change:
         try:
             resp = _glancev2_call(
-                'image_update', name=name,
+                'image_update', exact_image['id'],
                 properties=to_change, cloud_name=cloud_name,
             )
         except Exception as e:
             log.error('Glance image update failed with {}'.format(e))
             return _update_failed(name, 'image')
+        _catalog_put(cloud_name, resp)
         return _updated(name, 'image', resp)
     return _no_changes(name, 'image')
 
 
-def image_absent(name, cloud_name):
+def images_present(name, cloud_name, images, timeout=600, sleep_time=5,
+                   workers=8, remove_properties=False):
+    """
+    Ensures a set of images is present in one pass
+
+    The image catalog is fetched once and diffed locally against
+    ``images``. Imports and property updates are sent through a pool of
+    ``workers`` threads and all import tasks are waited on together.
+
+    :param name: name of the state
+    :param cloud_name: name of the cloud in cloud.yaml
+    :param images: Dict of image name to image definition. Each
+           definition takes the ``location``, ``image_properties``,
+           ``import_from_format``, ``checksum``, ``timeout`` and
+           ``remove_properties`` parameters of :func:`image_present`.
+           The import tasks are waited on together for the longest
+           of their timeouts.
+    :param timeout: (optional) Time for all import tasks to complete,
+                    also the default of the image timeouts
+    :param sleep_time: (optional) Longest interval between task polls
+    :param workers: (optional) Number of concurrent Glance requests
+    :param remove_properties: (optional) remove custom properties of the
+                              images that are not in their image_properties
+    """
+    ret = {'name': name, 'changes': {}, 'result': True, 'comment': ''}
+
+    imports = {}
+    updates = {}
+    failed = []
+    for image_name, definition in images.items():
+        properties = dict(definition.get('image_properties') or {})
+        existing = _catalog_find(cloud_name, image_name)
+        if len(existing) > 1:
+            failed.append(image_name)
+            ret['changes'][image_name] = _find_failed(image_name, 'image')
+        elif existing:
+            to_change = _image_patch(
+                existing[0], properties,
+                definition.get('remove_properties', remove_properties))
+            if to_change:
+                updates[image_name] = (existing[0]['id'], to_change)
+        else:
+            properties['name'] = image_name
+            imports[image_name] = {
+                'import_from': definition.get('location'),
+                'import_from_format': definition.get(
+                    'import_from_format', 'raw'),
+                'image_properties': properties,
+            }
+
+    # Loader dunders are not visible from pool threads on newer Salt,
+    # resolve the functions here and only touch __context__ from this
+    # thread
+    image_update = __salt__['glancev2.image_update']
+    task_create = __salt__['glancev2.task_create']
+    image_get_details = __salt__['glancev2.image_get_details']
+
+    def _update(image_name):
+        image_id, to_change = updates[image_name]
+        try:
+            resp = image_update(
+                image_id, properties=to_change,
+                cloud_name=cloud_name,
+            )
+        except Exception as e:
+            log.error('Glance image update failed with {}'.format(e))
+            return _update_failed(image_name, 'image'), None
+        return _updated(image_name, 'image', resp), resp
+
+    def _create_task(image_name):
+        try:
+            return task_create(
+                task_type='import',
+                task_input=imports[image_name], cloud_name=cloud_name
+            )
+        except Exception as e:
+            log.error(
+                'Glance image create failed on create task with {}'.format(e)
+            )
+            return None
+
+    def _verify(image_name):
+        checksum = images[image_name].get('checksum')
+        try:
+            image = image_get_details(
+                created[image_name],
+                cloud_name=cloud_name
+            )
+        except Exception as e:
+            log.error('Glance image lookup failed with {}'.format(e))
+            return _create_failed(image_name, 'image'), None
+        if not checksum or image['status'] != 'active':
+            return None, image
+        if image.get('checksum') != checksum:
+            log.error(
+                'Glance image create failed since image_checksum should '
+                'be {} but it is {}'.format(checksum, image.get('checksum'))
+            )
+            return _create_failed(image_name, 'image'), image
+        return None, image
+
+    pool = ThreadPool(max(1, int(workers)))
     try:
-        image = _glancev2_call(
-            'image_get_details', name=name, cloud_name=cloud_name
-        )
-    except Exception as e:
-        if 'ResourceNotFound' in repr(e):
-            return _absent(name, 'image')
-        if 'MultipleResourcesFound' in repr(e):
-            return _find_failed(name, 'image')
+        update_names = list(updates)
+        for image_name, (resp, image) in zip(
+                update_names, pool.map(_update, update_names)):
+            ret['changes'][image_name] = resp
+            if image:
+                _catalog_put(cloud_name, image)
+
+        import_names = list(imports)
+        tasks = {}
+        for image_name, task in zip(import_names,
+                                    pool.map(_create_task, import_names)):
+            if task is None:
+                ret['changes'][image_name] = _create_failed(
+                    image_name, 'image_task')
+            else:
+                tasks[image_name] = task
+
+        created = {}
+        pending = [t['id'] for t in tasks.values()
+                   if t['status'] not in ('success', 'failure')]
+        if pending:
+            wait = max([float(timeout)] + [
+                float(images[n]['timeout']) for n in tasks
+                if images[n].get('timeout') is not None])
+            try:
+                finished = _glancev2_call(
+                    'tasks_wait', pending, timeout=wait,
+                    max_interval=sleep_time, workers=workers,
+                    cloud_name=cloud_name
+                )
+            except Exception as e:
+                log.error(
+                    'Glance failed to check task status with {}'.format(e))
+                finished = {}
+            for image_name, task in list(tasks.items()):
+                if task['id'] in pending:
+                    tasks[image_name] = finished.get(task['id'])
+
+        for image_name, task in tasks.items():
+            if task is None:
+                ret['changes'][image_name] = _create_failed(
+                    image_name, 'image_task')
+            elif task['status'] == 'success':
+                created[image_name] = (
+                    task.get('result') or {}).get('image_id', image_name)
+                ret['changes'][image_name] = _created(
+                    image_name, 'image', task.get('result') or {})
+            elif task['status'] == 'failure':
+                log.error('Glance task failed to complete')
+                ret['changes'][image_name] = _create_failed(
+                    image_name, 'image')
+            else:
+                log.error(
+                    'Glance task failed to import image {} for given '
+                    'amount of time'.format(image_name)
+                )
+                ret['changes'][image_name] = _create_failed(
+                    image_name, 'image')
+
+        to_verify = list(created)
+        for image_name, (resp, image) in zip(
+                to_verify, pool.map(_verify, to_verify)):
+            if image:
+                _catalog_put(cloud_name, image)
+            if resp is not None:
+                ret['changes'][image_name] = resp
+    finally:
+        pool.close()
+
+    failed.extend(n for n, c in ret['changes'].items() if not c['result'])
+    ret['changes'] = dict(
+        (n, c) for n, c in ret['changes'].items() if c['changes'] or
+        not c['result']
+    )
+    if failed:
+        ret['result'] = False
+        ret['comment'] = 'images {} failed'.format(
+            ', '.join(sorted(set(failed))))
+    else:
+        ret['comment'] = 'images are in desired state'
+    return ret
+
+
+def image_absent(name, cloud_name):
+    images = _catalog_find(cloud_name, name)
+    if not images:
+        return _absent(name, 'image')
+    if len(images) > 1:
+        return _find_failed(name, 'image')
     try:
         _glancev2_call(
-            'image_delete', name=name, cloud_name=cloud_name
+            'image_delete', images[0]['id'], cloud_name=cloud_name
         )
     except Exception as e:
         log.error('Glance image delete failed with {}'.format(e))
         return _delete_failed(name, 'image')
+    _catalog_drop(cloud_name, images[0]['id'])
     return _deleted(name, 'image')
 
 
+def _catalog(cloud_name):
+    """
+    Return the image catalog snapshot of the cloud for this state run
+
+    The catalog is listed once per run and kept in __context__, which
+    lives as long as the state run. It is indexed by image id and name.
+    """
+    catalogs = __context__.setdefault('glancev2.catalog', {})
+    if cloud_name not in catalogs:
+        catalog = {'by_id': {}, 'by_name': {}}
+        for image in _glancev2_call(
+                'image_list', as_generator=True, cloud_name=cloud_name):
+            catalog['by_id'][image['id']] = image
+            catalog['by_name'].setdefault(
+                image.get('name'), set()).add(image['id'])
+        catalogs[cloud_name] = catalog
+    return catalogs[cloud_name]
+
+
+def _catalog_find(cloud_name, name):
+    catalog = _catalog(cloud_name)
+    return [catalog['by_id'][image_id]
+            for image_id in catalog['by_name'].get(name, ())]
+
+
+def _catalog_drop(cloud_name, image_id):
+    catalog = _catalog(cloud_name)
+    image = catalog['by_id'].pop(image_id, None)
+    if image is not None:
+        catalog['by_name'].get(image.get('name'), set()).discard(image_id)
+
+
+def _catalog_put(cloud_name, image):
+    _catalog_drop(cloud_name, image['id'])
+    catalog = _catalog(cloud_name)
+    catalog['by_id'][image['id']] = image
+    catalog['by_name'].setdefault(image.get('name'), set()).add(image['id'])
+
+
+# Image attributes set by Glance itself
+READ_ONLY_PROPERTIES = frozenset([
+    'id', 'status', 'checksum', 'size', 'virtual_size', 'created_at',
+    'updated_at', 'file', 'schema', 'self', 'direct_url', 'locations',
+    'os_hash_algo', 'os_hash_value', 'stores',
+])
+# Writable image attributes that are part of the image schema and so are
+# never removed
+BASE_PROPERTIES = frozenset([
+    'name', 'visibility', 'protected', 'container_format', 'disk_format',
+    'min_disk', 'min_ram', 'tags', 'owner', 'os_hidden',
+])
+
+
+def _patch_path(prop):
+    return '/{}'.format(prop.replace('~', '~0').replace('/', '~1'))
+
+
+def _same_value(prop, current, wanted):
+    if prop == 'tags':
+        return set(current or []) == set(wanted or [])
+    if isinstance(current, bool) and not isinstance(wanted, bool):
+        # Pillar rendered booleans may come as strings
+        return str(current).lower() == str(wanted).lower()
+    return current == wanted
+
+
+def _patch_value(current, wanted):
+    if isinstance(current, bool) and not isinstance(wanted, bool):
+        return str(wanted).lower() == 'true'
+    return wanted
+
+
+def _image_patch(exact_image, image_properties, remove_properties=False):
+    """
+    Build the minimal RFC 6902 patch turning exact_image into one with
+    image_properties
+    """
+    to_change = []
+    for prop in sorted(image_properties):
+        if prop in READ_ONLY_PROPERTIES:
+            continue
+        wanted = image_properties[prop]
+        if prop in exact_image:
+            if not _same_value(prop, exact_image[prop], wanted):
+                to_change.append({
+                    'op': 'replace',
+                    'path': _patch_path(prop),
+                    'value': _patch_value(exact_image[prop], wanted)
+                })
+        else:
+            to_change.append({
+                'op': 'add',
+                'path': _patch_path(prop),
+                'value': wanted
+            })
+    if remove_properties:
+        for prop in sorted(exact_image):
+            if (prop in image_properties or prop in READ_ONLY_PROPERTIES or
+                    prop in BASE_PROPERTIES or prop.startswith('os_glance')):
+                continue
+            to_change.append({'op': 'remove', 'path': _patch_path(prop)})
+    return to_change
+
+
 def _created(name, resource, resource_definition):
     changes_dict = {
         'name': name,
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""Micro-benchmarks of the glancev2 execution modules
+
+Runs the modules in-process against the fake Glance server from
+``fakeglance.py`` and reports throughput and the number of API requests
+of every operation. Nothing leaves the host, so results are comparable
+between runs and changes of ``_modules/glancev2`` can be measured
+offline::
+
+    python tests/benchmark.py --images 50000 --size 10G --latency 0.002
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, '..', '_modules'))
+sys.path.insert(0, CURDIR)
+
+from fakeglance import FakeGlance  # noqa
+
+CLOUD = 'fake'
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def size(value):
+    value = value.upper().rstrip('B')
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+class Bench(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.results = []
+
+    def run(self, name, func, count, unit='ops'):
+        """Time func and record its rate in units per second"""
+        self.server.reset_calls()
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        self.results.append({
+            'name': name,
+            'count': count,
+            'unit': unit,
+            'seconds': round(elapsed, 4),
+            'rate': round(count / elapsed, 2) if elapsed else None,
+            'requests': self.server.total_calls(auth=False),
+            'auth': self.server.total_calls(auth=True),
+        })
+
+    def report(self):
+        print('{:<28} {:>10} {:>10} {:>14} {:>9} {:>5}'.format(
+            'benchmark', 'count', 'seconds', 'rate', 'requests', 'auth'))
+        for r in self.results:
+            count = r['count']
+            rate = r['rate'] or 0
+            if r['unit'] == 'bytes':
+                count = '{:.0f}M'.format(count / float(UNITS['M']))
+                rate = '{:.1f} MiB/s'.format(rate / UNITS['M'])
+            else:
+                rate = '{:.1f} {}/s'.format(rate, r['unit'])
+            print('{:<28} {:>10} {:>10.3f} {:>14} {:>9} {:>5}'.format(
+                r['name'], count, r['seconds'], rate, r['requests'],
+                r['auth']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=5000,
+                        help='number of images in the catalog')
+    parser.add_argument('--size', type=size, default=size('256M'),
+                        help='size of the downloaded and uploaded image')
+    parser.add_argument('--operations', type=int, default=200,
+                        help='number of resolve and update calls')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--parallel', type=int, default=4,
+                        help='ranges of the parallel download')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the server to each request')
+    parser.add_argument('--bandwidth', type=size, default=None,
+                        help='bytes per second of image data transfers')
+    parser.add_argument('--only', action='append',
+                        choices=('list', 'resolve', 'update', 'download',
+                                 'upload'),
+                        help='run only the given benchmarks')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args(argv)
+    only = set(args.only or ('list', 'resolve', 'update', 'download',
+                             'upload'))
+
+    workdir = tempfile.mkdtemp(prefix='glancev2-bench-')
+    server = FakeGlance(latency=args.latency, bandwidth=args.bandwidth)
+    try:
+        server.start()
+        os.environ['OS_CLIENT_CONFIG_FILE'] = server.clouds_yaml(
+            os.path.join(workdir, 'clouds.yaml'), CLOUD)
+        import glancev2
+        from glancev2 import common
+
+        server.add_images(args.images)
+        big = server.add_image('bench-data', size=args.size,
+                               disk_format='raw', container_format='bare')
+        names = ['image-{:06d}'.format(i * args.images // args.operations)
+                 for i in range(min(args.operations, args.images))]
+        bench = Bench(server)
+        # Authenticate outside of the measurements
+        glancev2.image_get_details(big['id'], cloud_name=CLOUD)
+
+        if 'list' in only:
+            bench.run('image_list', lambda: glancev2.image_list(
+                page_size=args.page_size, cloud_name=CLOUD),
+                args.images + 1, 'images')
+            bench.run('image_list as_generator', lambda: sum(
+                1 for _ in glancev2.image_list(
+                    as_generator=True, page_size=args.page_size,
+                    cloud_name=CLOUD)), args.images + 1, 'images')
+
+        if 'resolve' in only:
+            resolve = common.get_by_name_or_uuid(
+                glancev2.image_list, 'images')(lambda image_id, **kw: image_id)
+
+            def resolve_all():
+                for name in names:
+                    resolve(name, cloud_name=CLOUD)
+
+            common.RESOLUTION_CACHE.clear()
+            bench.run('resolve name', resolve_all, len(names))
+            bench.run('resolve name cached', resolve_all, len(names))
+
+        if 'update' in only:
+            def update_all():
+                for i, name in enumerate(names):
+                    glancev2.image_update(name, [
+                        {'op': 'add', 'path': '/bench', 'value': str(i)}],
+                        cloud_name=CLOUD)
+
+            common.RESOLUTION_CACHE.clear()
+            bench.run('image_update by name', update_all, len(names))
+
+        data = os.path.join(workdir, 'data')
+        if 'download' in only:
+            for parallel in sorted(set((1, args.parallel))):
+                bench.run(
+                    'image_download parallel={}'.format(parallel),
+                    lambda: glancev2.image_download(
+                        big['id'], data, parallel=parallel,
+                        cloud_name=CLOUD), args.size, 'bytes')
+                os.unlink(data)
+
+        if 'upload' in only:
+            with open(data, 'wb') as f:
+                f.truncate(args.size)
+            target = glancev2.image_create(name='bench-upload',
+                                           cloud_name=CLOUD)
+            bench.run('image_upload', lambda: glancev2.image_upload(
+                target['id'], data, cloud_name=CLOUD), args.size, 'bytes')
+
+        if args.json:
+            print(json.dumps({'args': vars(args), 'results': bench.results},
+                             indent=2))
+        else:
+            bench.report()
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""API call budget of glance/client.sls as the image pillar grows
+
+Renders ``glance.client`` with synthetic pillars of 10, 100 and 1000
+images and runs the resulting ``glancev2`` and ``glanceng`` states, one
+state at a time, against the fake Glance server from ``fakeglance.py``.
+Every scale is applied twice, the first run creates the images and the
+second one finds them converged.
+
+Glance requests, identity requests, sleeps and wall time are recorded
+per state. The run fails when a total is above its budget in
+``budgets.yaml``, a fixed allowance plus an allowance per image::
+
+    python tests/budget.py --scales 10,100,1000
+
+The ``glanceng`` scenario needs the ``keystoneng`` module of the keystone
+formula, it is looked up in ``--formulas`` and skipped when missing.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import salt.config
+import salt.state
+import yaml
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+ROOTDIR = os.path.dirname(CURDIR)
+sys.path.insert(0, CURDIR)
+
+from fakeglance import FakeGlance, sum_calls  # noqa
+
+SCENARIOS = ('glancev2', 'glancev2_batch', 'glanceng')
+RUNS = ('create', 'converge')
+STATE_MODULES = ('glancev2', 'glanceng')
+
+
+class SleepCounter(object):
+    """Count calls of time.sleep and the seconds slept"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self._sleep = time.sleep
+
+    def __call__(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        self._sleep(seconds)
+
+    def __enter__(self):
+        time.sleep = self
+        return self
+
+    def __exit__(self, *exc_info):
+        time.sleep = self._sleep
+
+
+def image_pillar(count, server_url):
+    images = {}
+    for i in range(count):
+        images['image-{:06d}'.format(i)] = {
+            'visibility': 'public',
+            'protected': False,
+            'tags': ['budget'],
+            'disk_format': 'raw',
+            'container_format': 'bare',
+            'import_from_format': 'raw',
+            'location': '{}/source/{}.img'.format(server_url, i),
+        }
+    return images
+
+
+def pillar(scenario, count, server, cloud_name):
+    identity = {'image': image_pillar(count, server.url)}
+    client = {'enabled': True, 'pkgs': [], 'identity': {'budget': identity}}
+    pillar = {'glance': {'client': client}}
+    if scenario.startswith('glancev2'):
+        client['cloud_name'] = cloud_name
+        client['batch'] = scenario == 'glancev2_batch'
+        client['batch_timeout'] = 60
+    else:
+        pillar['budget'] = {
+            'keystone.auth_url': server.auth_url,
+            'keystone.user': 'admin',
+            'keystone.password': 'secret',
+            'keystone.tenant': 'admin',
+            'keystone.region_name': 'RegionOne',
+        }
+    return pillar
+
+
+def minion_opts(workdir, formulas, pillar_data):
+    pillar_dir = os.path.join(workdir, 'pillar')
+    os.makedirs(pillar_dir)
+    with open(os.path.join(pillar_dir, 'top.sls'), 'w') as f:
+        yaml.safe_dump({'base': {'*': ['budget']}}, f)
+    with open(os.path.join(pillar_dir, 'budget.sls'), 'w') as f:
+        yaml.safe_dump(pillar_data, f)
+
+    opts = salt.config.minion_config(None)
+    opts.update({
+        'id': 'budget',
+        'file_client': 'local',
+        'cachedir': os.path.join(workdir, 'cache'),
+        'pki_dir': os.path.join(workdir, 'pki'),
+        'sock_dir': os.path.join(workdir, 'sock'),
+        'file_roots': {'base': [ROOTDIR]},
+        'pillar_roots': {'base': [pillar_dir]},
+        'module_dirs': [os.path.join(path, '_modules')
+                        for path in [ROOTDIR] + formulas],
+        'states_dirs': [os.path.join(ROOTDIR, '_states')],
+        'test': False,
+    })
+    return opts
+
+
+def measure(scenario, count, args, budgets):
+    """Apply glance.client twice, return per run totals and state samples"""
+    workdir = tempfile.mkdtemp(prefix='glance-budget-')
+    server = FakeGlance(latency=args.latency, task_delay=args.task_delay)
+    cloud_name = 'budget{}'.format(count)
+    results = []
+    try:
+        server.start()
+        os.environ['OS_CLIENT_CONFIG_FILE'] = server.clouds_yaml(
+            os.path.join(workdir, 'clouds.yaml'), cloud_name)
+        opts = minion_opts(workdir, args.formulas,
+                           pillar(scenario, count, server, cloud_name))
+        for run in RUNS:
+            server.reset_calls()
+            started = time.time()
+            samples, sleeps, slept = apply_in_process(opts, server)
+            totals = {
+                'requests': server.total_calls(auth=False),
+                'auth': server.total_calls(auth=True),
+                'sleeps': sleeps,
+                'slept': slept,
+                'states': len(samples),
+                'failed': sum(1 for s in samples if not s['result']),
+            }
+            results.append(check(scenario, run, count, totals,
+                                 time.time() - started, samples,
+                                 budgets.get(scenario, {}).get(run, {})))
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+_RUN = {}
+
+
+def apply_in_process(opts, server):
+    """Apply the states in a forked process like a fresh salt-call
+
+    Module level clients and caches of the previous run are not reused.
+    """
+    _RUN.update(opts=opts, server=server)
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_apply)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _apply():
+    opts, server = _RUN['opts'], _RUN['server']
+    state = salt.state.State(opts)
+    chunks = state.compile_high_data(_render(opts))
+    if isinstance(chunks, tuple):
+        # Salt 3007 and later also return the ordering errors
+        chunks = chunks[0]
+    samples = []
+    with SleepCounter() as sleeps:
+        for chunk in chunks:
+            if chunk['state'] not in STATE_MODULES:
+                continue
+            before = server.remote_calls()
+            slept = sleeps.calls
+            started = time.time()
+            ret = state.call(chunk)
+            seconds = time.time() - started
+            calls = server.remote_calls() - before
+            samples.append({
+                'state': '{}.{}'.format(chunk['state'], chunk['fun']),
+                'id': chunk['__id__'],
+                'result': ret['result'],
+                'requests': sum_calls(calls, auth=False),
+                'auth': sum_calls(calls, auth=True),
+                'sleeps': sleeps.calls - slept,
+                'seconds': round(seconds, 4),
+            })
+            if not ret['result']:
+                log_failure(chunk, ret)
+    return samples, sleeps.calls, sleeps.seconds
+
+
+def _render(opts):
+    """Render glance.client with the pillar of opts into high data"""
+    highstate = salt.state.HighState(opts)
+    high, errors = highstate.render_highstate({'base': ['glance.client']})
+    if errors:
+        raise RuntimeError('Rendering glance.client failed: {}'.format(
+            errors))
+    return high
+
+
+def log_failure(chunk, ret):
+    print('FAILED {}.{} {}: {}'.format(
+        chunk['state'], chunk['fun'], chunk['__id__'], ret.get('comment')),
+        file=sys.stderr)
+
+
+def limits(budget, count):
+    """Absolute limits of a run, per image budgets scaled to the pillar"""
+    result = {}
+    if 'requests_per_image' in budget or 'requests' in budget:
+        result['requests'] = (budget.get('requests', 0) +
+                              budget.get('requests_per_image', 0) * count)
+    if 'sleeps_per_image' in budget or 'sleeps' in budget:
+        result['sleeps'] = (budget.get('sleeps', 0) +
+                            budget.get('sleeps_per_image', 0) * count)
+    if 'auth' in budget:
+        result['auth'] = budget['auth']
+    return result
+
+
+def check(scenario, run, count, totals, wall, samples, budget):
+    over = dict((metric, (totals[metric], limit))
+                for metric, limit in limits(budget, count).items()
+                if totals[metric] > limit)
+    slowest = max(samples, key=lambda s: s['seconds']) if samples else None
+    return {
+        'scenario': scenario,
+        'run': run,
+        'images': count,
+        'states': totals['states'],
+        'failed': totals['failed'],
+        'requests': totals['requests'],
+        'requests_per_image': round(totals['requests'] / float(count), 3),
+        'auth': totals['auth'],
+        'sleeps': totals['sleeps'],
+        'slept': round(totals['slept'], 3),
+        'seconds': round(wall, 3),
+        'slowest_state': slowest and {
+            'id': slowest['id'], 'seconds': slowest['seconds']},
+        'over_budget': over,
+        'budgeted': bool(budget),
+        'samples': samples,
+    }
+
+
+def report(results):
+    print('{:<15} {:<9} {:>6} {:>6} {:>9} {:>8} {:>5} {:>7} {:>9}  {}'.format(
+        'scenario', 'run', 'images', 'states', 'requests', 'per-img',
+        'auth', 'sleeps', 'seconds', 'budget'))
+    for r in results:
+        if r['over_budget']:
+            verdict = 'OVER ' + ', '.join(
+                '{} {} > {:g}'.format(metric, value, limit)
+                for metric, (value, limit) in sorted(
+                    r['over_budget'].items()))
+        elif r['failed']:
+            verdict = 'FAILED {} states'.format(r['failed'])
+        elif not r['budgeted']:
+            verdict = 'no budget'
+        else:
+            verdict = 'ok'
+        print('{:<15} {:<9} {:>6} {:>6} {:>9} {:>8} {:>5} {:>7} {:>9.2f}  {}'
+              .format(r['scenario'], r['run'], r['images'], r['states'],
+                      r['requests'], r['requests_per_image'], r['auth'],
+                      r['sleeps'], r['seconds'], verdict))
+
+
+def keystoneng_available(formulas):
+    return any(os.path.exists(os.path.join(path, '_modules', 'keystoneng.py'))
+               for path in formulas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='10,100,1000',
+                        help='comma separated numbers of images')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='run only the given scenarios')
+    parser.add_argument('--budgets',
+                        default=os.path.join(CURDIR, 'budgets.yaml'))
+    parser.add_argument('--formulas', action='append',
+                        default=['/usr/share/salt-formulas/env'],
+                        help='directories with the _modules of dependencies')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the server to each request')
+    parser.add_argument('--task-delay', type=float, default=0.0,
+                        help='seconds an import task takes on the server')
+    parser.add_argument('--json', action='store_true',
+                        help='print results with per state samples as JSON')
+    args = parser.parse_args(argv)
+
+    with open(args.budgets) as f:
+        budgets = yaml.safe_load(f) or {}
+    scenarios = args.scenario or list(SCENARIOS)
+    if 'glanceng' in scenarios and not keystoneng_available(args.formulas):
+        print('Skipping glanceng, keystoneng module not found in {}'.format(
+            ', '.join(args.formulas)), file=sys.stderr)
+        scenarios.remove('glanceng')
+
+    results = []
+    for scenario in scenarios:
+        for count in [int(c) for c in args.scales.split(',')]:
+            results.extend(measure(scenario, count, args, budgets))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+    failed = [r for r in results if r['over_budget'] or r['failed']]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,627 @@
+"""In-process stand-in for the Keystone v3 and Glance v2 APIs
+
+Serves just enough of both APIs for the ``glancev2`` and ``glanceng``
+modules: token issue with a service catalog, version discovery, images
+with paging and JSON patch, image data with ranges, actions and import
+tasks. Every request is counted per method and endpoint so callers can
+check how many API calls an operation costs.
+
+Knobs:
+
+* ``latency`` - seconds added to every request
+* ``bandwidth`` - bytes per second limit of image data transfers
+* ``task_delay`` - seconds an import task stays in ``processing``
+* ``page_max`` - largest page size the server returns
+* ``etags`` - send ``ETag`` on details and honour ``If-None-Match``
+
+Usage::
+
+    with FakeGlance(latency=0.005) as server:
+        server.add_images(50000)
+        server.clouds_yaml('/tmp/clouds.yaml')
+"""
+from __future__ import print_function
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlencode, urlparse
+    from urllib.request import urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urllib2 import urlopen
+    from urlparse import parse_qs, urlparse
+import collections
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+UUID_RE = re.compile('[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                     '[0-9a-f]{12}')
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+BLOCK_SIZE = 1024 * 1024
+IMAGE_PREFIX = '/image'
+IDENTITY_PREFIX = '/identity'
+# Request counters, not counted themselves
+CALLS_PATH = '/_calls'
+
+READ_ONLY = frozenset((
+    'id', 'status', 'created_at', 'updated_at', 'checksum', 'size',
+    'virtual_size', 'file', 'schema', 'self', 'direct_url', 'locations',
+    'os_hash_algo', 'os_hash_value',
+))
+# Properties of the Glance v2 task schema
+TASK_PROPERTIES = (
+    'id', 'type', 'status', 'input', 'result', 'owner', 'message',
+    'expires_at', 'created_at', 'updated_at', 'self', 'schema',
+)
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class PatternBlob(object):
+    """Synthetic image data, a pseudo-random block repeated up to size
+
+    Nothing but the block is kept in memory so images of any size can be
+    served. Digests are computed once on first use.
+    """
+
+    _block = None
+
+    def __init__(self, size):
+        self.size = size
+        self._digests = None
+        if PatternBlob._block is None:
+            rnd = random.Random(0)
+            PatternBlob._block = bytes(bytearray(
+                rnd.getrandbits(8) for _ in range(BLOCK_SIZE)))
+
+    def read(self, offset, length):
+        block = self._block
+        out = []
+        while length > 0:
+            start = offset % BLOCK_SIZE
+            piece = block[start:start + length]
+            out.append(piece)
+            offset += len(piece)
+            length -= len(piece)
+        return b''.join(out)
+
+    def digests(self):
+        if self._digests is None:
+            md5, sha512 = hashlib.md5(), hashlib.sha512()
+            for offset in range(0, self.size, BLOCK_SIZE):
+                chunk = self.read(offset, min(BLOCK_SIZE, self.size - offset))
+                md5.update(chunk)
+                sha512.update(chunk)
+            self._digests = md5.hexdigest(), sha512.hexdigest()
+        return self._digests
+
+
+class FileBlob(object):
+    """Uploaded image data kept in a file of the server data directory"""
+
+    def __init__(self, path, size, digests):
+        self.path = path
+        self.size = size
+        self._digests = digests
+
+    def read(self, offset, length):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def digests(self):
+        return self._digests
+
+
+def sum_calls(calls, auth=None):
+    """Count requests, only (or no) identity requests if auth is set"""
+    return sum(n for key, n in calls.items()
+               if auth is None or key.endswith((' auth', ' identity')) == auth)
+
+
+def _image_template(image_id):
+    return {
+        'id': image_id,
+        'name': None,
+        'status': 'queued',
+        'visibility': 'shared',
+        'protected': False,
+        'tags': [],
+        'disk_format': None,
+        'container_format': None,
+        'min_disk': 0,
+        'min_ram': 0,
+        'size': None,
+        'checksum': None,
+        'os_hash_algo': None,
+        'os_hash_value': None,
+        'owner': 'admin',
+        'created_at': _now(),
+        'updated_at': _now(),
+        'self': '/v2/images/' + image_id,
+        'file': '/v2/images/{}/file'.format(image_id),
+        'schema': '/v2/schemas/image',
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            return self._chunks()
+        length = int(self.headers.get('Content-Length') or 0)
+        return iter([self.rfile.read(length)] if length else [])
+
+    def _chunks(self):
+        while True:
+            size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+            if not size:
+                self.rfile.readline()
+                return
+            yield self.rfile.read(size)
+            self.rfile.readline()
+
+    def _json_body(self):
+        data = b''.join(self._body())
+        return json.loads(data.decode('utf-8')) if data else {}
+
+    def _handle(self):
+        server = self.server.fake
+        url = urlparse(self.path)
+        if url.path == CALLS_PATH:
+            with server._lock:
+                body = json.dumps(server.calls).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        server.count(self.command, url.path)
+        if server.latency:
+            time.sleep(server.latency)
+        try:
+            status, headers, body = server.dispatch(self, url)
+        except _Error as e:
+            status, headers, body = e.status, {}, {'message': e.message}
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if hasattr(body, 'size'):
+            self.send_header('Content-Length', str(body.size))
+            self.end_headers()
+            for chunk in body:
+                self.wfile.write(chunk)
+            return
+        body = body or b''
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+class _Error(Exception):
+
+    def __init__(self, status, message):
+        super(_Error, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class _Stream(object):
+    """Body of a data response, read block by block and throttled"""
+
+    def __init__(self, blob, start, end, bandwidth):
+        self.blob = blob
+        self.start = start
+        self.size = end - start + 1
+        self.bandwidth = bandwidth
+
+    def __iter__(self):
+        offset, end = self.start, self.start + self.size
+        started = time.time()
+        while offset < end:
+            chunk = self.blob.read(offset, min(BLOCK_SIZE, end - offset))
+            offset += len(chunk)
+            if self.bandwidth:
+                ahead = (offset - self.start) / float(self.bandwidth) - (
+                    time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            yield chunk
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeGlance(object):
+
+    def __init__(self, latency=0.0, bandwidth=None, task_delay=0.0,
+                 page_max=1000, etags=True, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.task_delay = task_delay
+        self.page_max = page_max
+        self.etags = etags
+        self.images = collections.OrderedDict()
+        self._names = collections.defaultdict(list)
+        self.tasks = collections.OrderedDict()
+        self.blobs = {}
+        self.calls = collections.Counter()
+        self._lock = threading.RLock()
+        self._tokens = set()
+        self._datadir = tempfile.mkdtemp(prefix='fakeglance-')
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self._httpd.server_address[:2])
+
+    @property
+    def auth_url(self):
+        return self.url + IDENTITY_PREFIX + '/v3'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        shutil.rmtree(self._datadir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def clouds_yaml(self, path, cloud_name='fake'):
+        """Write an os-client-config file pointing at this server"""
+        with open(path, 'w') as f:
+            json.dump({'clouds': {cloud_name: {
+                'auth': {
+                    'auth_url': self.auth_url,
+                    'username': 'admin',
+                    'password': 'secret',
+                    'project_name': 'admin',
+                    'user_domain_name': 'Default',
+                    'project_domain_name': 'Default',
+                },
+                'identity_api_version': '3',
+                'region_name': 'RegionOne',
+            }}}, f)
+        return path
+
+    # Request accounting
+
+    def count(self, method, path):
+        if path.startswith(IDENTITY_PREFIX):
+            key = 'auth' if path.endswith('/auth/tokens') else 'identity'
+        else:
+            key = UUID_RE.sub('{id}', path[len(IMAGE_PREFIX):])
+            key = re.sub('^/v2', '', key.rstrip('/')) or 'versions'
+        with self._lock:
+            self.calls['{} {}'.format(method, key)] += 1
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def total_calls(self, auth=None):
+        """Count requests, only (or no) identity requests if auth is set"""
+        with self._lock:
+            return sum_calls(self.calls, auth)
+
+    def remote_calls(self):
+        """Request counters fetched over HTTP, usable from other processes"""
+        response = urlopen(self.url + CALLS_PATH)
+        try:
+            return collections.Counter(json.loads(
+                response.read().decode('utf-8')))
+        finally:
+            response.close()
+
+    # Fixtures
+
+    def add_image(self, name=None, size=0, **properties):
+        image = _image_template(properties.pop('id', None) or
+                                str(uuid.uuid4()))
+        image['name'] = name
+        image.update(properties)
+        with self._lock:
+            self.images[image['id']] = image
+            self._names[name].append(image['id'])
+            if size:
+                self._set_data(image, PatternBlob(size))
+        return image
+
+    def add_images(self, count, prefix='image', **properties):
+        for i in range(count):
+            self.add_image('{}-{:06d}'.format(prefix, i), **properties)
+
+    def _set_data(self, image, blob):
+        md5, sha512 = blob.digests()
+        self.blobs[image['id']] = blob
+        image.update(size=blob.size, checksum=md5, os_hash_algo='sha512',
+                     os_hash_value=sha512, status='active',
+                     updated_at=_now())
+
+    # Dispatch
+
+    def dispatch(self, handler, url):
+        path = url.path.rstrip('/')
+        if path.startswith(IDENTITY_PREFIX):
+            return self._identity(handler, path[len(IDENTITY_PREFIX):])
+        if not path.startswith(IMAGE_PREFIX):
+            raise _Error(404, 'Unknown service')
+        path = path[len(IMAGE_PREFIX):]
+        if path in ('', '/versions'):
+            return 300 if not path else 200, {}, self._image_versions()
+        if path.startswith('/v2'):
+            path = path[3:]
+        if handler.headers.get('X-Auth-Token') not in self._tokens:
+            raise _Error(401, 'Authentication required')
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        parts = path.strip('/').split('/')
+        method = handler.command
+        if parts[0] == 'images':
+            return self._images(handler, method, parts[1:], query)
+        if parts[0] == 'tasks':
+            return self._tasks(handler, method, parts[1:], query)
+        if parts[0] == 'schemas':
+            return 200, {}, self._schema(parts[-1])
+        raise _Error(404, 'Not found')
+
+    def _identity(self, handler, path):
+        if path in ('', '/v3') and handler.command == 'GET':
+            version = {
+                'id': 'v3.10', 'status': 'stable', 'updated': _now(),
+                'links': [{'rel': 'self', 'href': self.auth_url + '/'}],
+                'media-types': [{
+                    'base': 'application/json',
+                    'type': 'application/vnd.openstack.identity-v3+json'}],
+            }
+            if path:
+                return 200, {}, {'version': version}
+            return 300, {}, {'versions': {'values': [version]}}
+        if path == '/v3/auth/tokens' and handler.command == 'POST':
+            handler._json_body()
+            token = uuid.uuid4().hex
+            with self._lock:
+                self._tokens.add(token)
+            expires = (datetime.datetime.utcnow() +
+                       datetime.timedelta(hours=1))
+            endpoint = {'id': 'e1', 'interface': 'public',
+                        'region': 'RegionOne', 'region_id': 'RegionOne',
+                        'url': self.url + IMAGE_PREFIX}
+            body = {'token': {
+                'methods': ['password'],
+                'expires_at': expires.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+                'issued_at': _now(),
+                'user': {'id': 'u1', 'name': 'admin',
+                         'domain': {'id': 'default', 'name': 'Default'}},
+                'project': {'id': 'p1', 'name': 'admin',
+                            'domain': {'id': 'default', 'name': 'Default'}},
+                'roles': [{'id': 'r1', 'name': 'admin'}],
+                'catalog': [{
+                    'id': 's1', 'type': 'image', 'name': 'glance',
+                    'endpoints': [
+                        dict(endpoint, interface=interface)
+                        for interface in ('public', 'internal', 'admin')],
+                }],
+            }}
+            return 201, {'X-Subject-Token': token}, body
+        raise _Error(404, 'Not found')
+
+    def _image_versions(self):
+        return {'versions': [{
+            'id': 'v2.6', 'status': 'CURRENT',
+            'links': [{'rel': 'self',
+                       'href': self.url + IMAGE_PREFIX + '/v2/'}],
+        }]}
+
+    def _schema(self, name):
+        keys = TASK_PROPERTIES if name == 'task' else _image_template('')
+        properties = dict((key, {}) for key in keys)
+        return {'name': name, 'properties': properties}
+
+    def _get_image(self, image_id):
+        try:
+            return self.images[image_id]
+        except KeyError:
+            raise _Error(404, 'No image found with ID {}'.format(image_id))
+
+    def _images(self, handler, method, parts, query):
+        with self._lock:
+            if not parts:
+                if method == 'GET':
+                    return 200, {}, self._image_page(query)
+                if method == 'POST':
+                    return 201, {}, self.add_image(**handler._json_body())
+            image = self._get_image(parts[0])
+            if len(parts) == 1:
+                if method == 'GET':
+                    return self._image_details(handler, image)
+                if method == 'PATCH':
+                    self._patch(image, handler._json_body())
+                    return 200, {}, image
+                if method == 'DELETE':
+                    if image['protected']:
+                        raise _Error(403, 'Image is protected')
+                    del self.images[image['id']]
+                    self._names[image['name']].remove(image['id'])
+                    self.blobs.pop(image['id'], None)
+                    return 204, {}, None
+            elif parts[1] == 'actions' and method == 'POST':
+                image['status'] = {'deactivate': 'deactivated',
+                                   'reactivate': 'active'}[parts[2]]
+                return 204, {}, None
+        if parts[1:] == ['file']:
+            if method == 'PUT':
+                return self._upload(handler, image)
+            if method == 'GET':
+                return self._download(handler, image)
+        raise _Error(405, 'Method not allowed')
+
+    def _image_page(self, query):
+        limit = min(int(query.pop('limit', 25)), self.page_max)
+        marker = query.pop('marker', None)
+        if 'name' in query and not marker:
+            # Name lookups are the common case, served from an index
+            images = [self.images[i] for i in
+                      self._names.get(query['name'], ())]
+        else:
+            images = list(self.images.values())
+        if marker:
+            ids = list(self.images)
+            if marker not in self.images:
+                raise _Error(400, 'Invalid marker')
+            images = images[ids.index(marker) + 1:]
+        filters = dict((k, v) for k, v in query.items()
+                       if k not in ('sort_key', 'sort_dir', 'sort'))
+        if filters:
+            images = [i for i in images
+                      if all(str(i.get(k)) == v for k, v in filters.items())]
+        page = images[:limit]
+        body = {'images': page, 'first': '/v2/images',
+                'schema': '/v2/schemas/images'}
+        if len(images) > limit:
+            body['next'] = '/v2/images?' + urlencode(
+                dict(query, limit=limit, marker=page[-1]['id']))
+        return body
+
+    def _image_details(self, handler, image):
+        if not self.etags:
+            return 200, {}, image
+        etag = '"{}"'.format(hashlib.md5(
+            json.dumps(image, sort_keys=True).encode('utf-8')).hexdigest())
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, None
+        return 200, {'ETag': etag}, image
+
+    def _patch(self, image, operations):
+        for op in operations:
+            key = op['path'].lstrip('/').replace('~1', '/').replace('~0', '~')
+            if key in READ_ONLY:
+                raise _Error(403, 'Attribute {} is read-only'.format(key))
+            if key == 'name':
+                self._names[image['name']].remove(image['id'])
+                self._names[op.get('value')].append(image['id'])
+            if op['op'] in ('add', 'replace'):
+                image[key] = op['value']
+            elif op['op'] == 'remove':
+                if key not in image:
+                    raise _Error(409, 'Property {} does not exist'.format(
+                        key))
+                del image[key]
+            else:
+                raise _Error(400, 'Invalid operation {}'.format(op['op']))
+        image['updated_at'] = _now()
+
+    def _upload(self, handler, image):
+        path = os.path.join(self._datadir, image['id'])
+        md5, sha512, size = hashlib.md5(), hashlib.sha512(), 0
+        with open(path, 'wb') as f:
+            for chunk in handler._body():
+                f.write(chunk)
+                md5.update(chunk)
+                sha512.update(chunk)
+                size += len(chunk)
+        with self._lock:
+            self._set_data(image, FileBlob(
+                path, size, (md5.hexdigest(), sha512.hexdigest())))
+        return 204, {}, None
+
+    def _download(self, handler, image):
+        blob = self.blobs.get(image['id'])
+        if blob is None:
+            return 204, {}, None
+        headers = {'Content-Type': 'application/octet-stream'}
+        match = RANGE_RE.match(handler.headers.get('Range') or '')
+        if not match:
+            headers['Content-Md5'] = blob.digests()[0]
+            return 200, headers, _Stream(blob, 0, blob.size - 1,
+                                         self.bandwidth)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or blob.size - 1), blob.size - 1)
+        if start > end:
+            raise _Error(416, 'Requested range not satisfiable')
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, end, blob.size)
+        return 206, headers, _Stream(blob, start, end, self.bandwidth)
+
+    def _tasks(self, handler, method, parts, query):
+        with self._lock:
+            if not parts and method == 'POST':
+                return 201, {}, self._task_create(handler._json_body())
+            if not parts and method == 'GET':
+                return 200, {}, {'tasks': [self._task_view(t) for t in
+                                           self.tasks.values()]}
+            if len(parts) == 1 and method == 'GET':
+                if parts[0] not in self.tasks:
+                    raise _Error(404, 'Task not found')
+                return 200, {}, self._task_view(self.tasks[parts[0]])
+        raise _Error(405, 'Method not allowed')
+
+    def _task_create(self, body):
+        task = {
+            'id': str(uuid.uuid4()),
+            'type': body.get('type'),
+            'input': body.get('input'),
+            'status': 'pending',
+            'result': None,
+            'message': '',
+            'owner': 'admin',
+            'created_at': _now(),
+            'updated_at': _now(),
+            'schema': '/v2/schemas/task',
+            '_ready': time.time() + self.task_delay,
+        }
+        self.tasks[task['id']] = task
+        view = dict(task, status='processing')
+        del view['_ready']
+        return view
+
+    def _task_view(self, task):
+        if task['status'] == 'pending':
+            task['status'] = 'processing'
+        if task['status'] == 'processing' and time.time() >= task['_ready']:
+            properties = dict(task['input'].get('image_properties') or {})
+            image = self.add_image(**properties)
+            self._set_data(image, PatternBlob(BLOCK_SIZE))
+            task.update(status='success', updated_at=_now(),
+                        result={'image_id': image['id']})
+        view = copy.deepcopy(task)
+        del view['_ready']
+        return view
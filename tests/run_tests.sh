@@ -193,6 +193,18 @@ case $1 in
     real-run)
         real_run
         ;;
+    unit)
+        python -m unittest discover -s ${CURDIR} -p 'test_*.py'
+        ;;
+    benchmark)
+        shift
+        python ${CURDIR}/benchmark.py "$@"
+        ;;
+    budget)
+        shift
+        python ${CURDIR}/budget.py \
+            --formulas ${DEPSDIR}/salt-formula-keystone "$@"
+        ;;
     *)
         prepare
         run
@@ -0,0 +1,157 @@
+"""Tests of the rule index of the glance_policy grain"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from test_glancev2_state import load_source
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+glance_policy = load_source(
+    'glance_policy', os.path.join(CURDIR, '..', '_grains', 'glance_policy.py'))
+
+POLICY = {
+    'context_is_admin': 'role:admin',
+    'admin_or_owner': 'is_admin:True or project_id:%(project_id)s',
+    'default': 'rule:admin_or_owner',
+    'publicize_image': 'rule:context_is_admin or role:Image_Manager',
+    'delete_image': 'rule:publicize_image and not role:readonly',
+    'get_images': '',
+    'get_image': '@',
+    'add_member': 'not (role:reader or rule:context_is_admin)',
+    'loop_a': 'rule:loop_b or role:a',
+    'loop_b': 'rule:loop_a or role:b',
+}
+
+
+class ReferencesTest(unittest.TestCase):
+
+    def test_roles_and_rules(self):
+        self.assertEqual(
+            glance_policy._references(
+                'rule:context_is_admin or (role:Member and role:Observer)'),
+            (set(['member', 'observer']), set(['context_is_admin'])))
+
+    def test_negated_checks_are_ignored(self):
+        self.assertEqual(
+            glance_policy._references('role:admin and not role:readonly'),
+            (set(['admin']), set()))
+        self.assertEqual(
+            glance_policy._references(
+                'not (role:reader or rule:owner) or role:admin'),
+            (set(['admin']), set()))
+        self.assertEqual(
+            glance_policy._references('not not role:admin'),
+            (set(['admin']), set()))
+
+    def test_legacy_list_syntax(self):
+        self.assertEqual(
+            glance_policy._references(
+                [['role:admin'], ['role:member', 'rule:owner']]),
+            (set(['admin', 'member']), set(['owner'])))
+        self.assertEqual(glance_policy._references([]), (set(), set()))
+
+
+class BuildIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = glance_policy._build_index(POLICY)
+
+    def test_transitive_resolution(self):
+        entry = self.index['rules']['delete_image']
+        self.assertEqual(entry['roles'], ['admin', 'image_manager'])
+        self.assertEqual(entry['rules'],
+                         ['context_is_admin', 'publicize_image'])
+        self.assertFalse(entry['open'])
+        self.assertEqual(self.index['rules']['default']['rules'],
+                         ['admin_or_owner'])
+        self.assertEqual(self.index['rules']['default']['roles'], [])
+
+    def test_cycles_terminate(self):
+        self.assertEqual(self.index['rules']['loop_a']['roles'], ['a', 'b'])
+        self.assertEqual(self.index['rules']['loop_b']['roles'], ['a', 'b'])
+        self.assertEqual(self.index['rules']['loop_a']['rules'],
+                         ['loop_a', 'loop_b'])
+
+    def test_roles_map_to_referring_rules(self):
+        self.assertEqual(sorted(self.index['roles']['admin']), [
+            'context_is_admin', 'delete_image', 'publicize_image'])
+        self.assertEqual(self.index['roles']['image_manager'], {
+            'publicize_image': POLICY['publicize_image'],
+            'delete_image': POLICY['delete_image'],
+        })
+        self.assertNotIn('readonly', self.index['roles'])
+        self.assertNotIn('reader', self.index['roles'])
+
+    def test_open_rules(self):
+        self.assertEqual(self.index['open'],
+                         {'get_images': '', 'get_image': '@'})
+
+    def test_nothing_changed_without_previous_index(self):
+        self.assertEqual(self.index['changed'], {})
+        again = glance_policy._build_index(POLICY, self.index)
+        self.assertEqual(again['changed'], {})
+        self.assertEqual(again['digest'], self.index['digest'])
+
+    def test_changed_rules(self):
+        policy = dict(POLICY, context_is_admin='role:cloud_admin',
+                      new_rule='role:admin')
+        del policy['get_images']
+        index = glance_policy._build_index(policy, self.index)
+        # A modified rule also changes the rules depending on it
+        self.assertEqual(index['changed'], {
+            'context_is_admin': 'modified',
+            'publicize_image': 'modified',
+            'delete_image': 'modified',
+            'new_rule': 'added',
+            'get_images': 'removed',
+        })
+        self.assertNotEqual(index['digest'], self.index['digest'])
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class GrainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.policy_file = os.path.join(self.tmp, 'policy.json')
+        self.saved = (glance_policy.POLICY_FILE, glance_policy._parse)
+        glance_policy.POLICY_FILE = self.policy_file
+        # keystone_policy.rule_list is not available outside of a minion
+        glance_policy._parse = lambda opts, path: load_json(path)
+        glance_policy.__opts__ = {'cachedir': self.tmp}
+
+    def tearDown(self):
+        glance_policy.POLICY_FILE, glance_policy._parse = self.saved
+        del glance_policy.__opts__
+        shutil.rmtree(self.tmp)
+
+    def write_policy(self, policy, mtime):
+        with open(self.policy_file, 'w') as f:
+            json.dump(policy, f)
+        os.utime(self.policy_file, (mtime, mtime))
+
+    def test_changes_are_reported_by_one_refresh(self):
+        now = time.time()
+        self.write_policy(POLICY, now - 10)
+        first = glance_policy.main()
+        self.assertEqual(first['glance_policy'], POLICY)
+        self.assertEqual(first['glance_policy_index']['changed'], {})
+
+        self.write_policy(dict(POLICY, get_images='role:admin'), now)
+        changed = glance_policy.main()['glance_policy_index']
+        self.assertEqual(changed['changed'], {'get_images': 'modified'})
+
+        cached = glance_policy.main()['glance_policy_index']
+        self.assertEqual(cached['changed'], {})
+        self.assertEqual(cached['digest'], changed['digest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
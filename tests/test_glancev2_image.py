@@ -0,0 +1,141 @@
+"""Tests of the glancev2 image data functions against the fake server"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(CURDIR, '..', '_modules'))
+sys.path.insert(0, CURDIR)
+
+from fakeglance import FakeGlance  # noqa
+
+CLOUD = 'fake'
+MB = 1024 * 1024
+
+
+def md5sum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MB), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class ImageDataTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeGlance()
+        cls.server.start()
+        cls.workdir = tempfile.mkdtemp(prefix='glancev2-test-')
+        os.environ['OS_CLIENT_CONFIG_FILE'] = cls.server.clouds_yaml(
+            os.path.join(cls.workdir, 'clouds.yaml'), CLOUD)
+        import glancev2
+        from glancev2 import cache
+        cls.glancev2 = glancev2
+        cls.cache = cache
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(dir=self.workdir)
+        self.server.reset_calls()
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def download(self, image, file_name, **kwargs):
+        return self.glancev2.image_download(image['id'], file_name,
+                                            cloud_name=CLOUD, **kwargs)
+
+    def file_gets(self):
+        return self.server.calls['GET /images/{id}/file']
+
+    def test_cached_data_survives_overwriting_a_placed_file(self):
+        small = self.server.add_image('small', size=5 * MB)
+        big = self.server.add_image('big', size=8 * MB)
+        cache_dir = self.path('cache')
+        disk = self.path('disk.img')
+        self.assertTrue(self.download(small, disk, cache_dir=cache_dir))
+        # Without the cache the next image lands on the placed file
+        self.assertTrue(self.download(big, disk))
+        self.assertEqual(md5sum(disk), big['checksum'])
+
+        self.server.reset_calls()
+        other = self.path('other.img')
+        self.assertTrue(self.download(small, other, cache_dir=cache_dir))
+        self.assertEqual(self.file_gets(), 0)
+        self.assertEqual(os.path.getsize(other), 5 * MB)
+        self.assertEqual(md5sum(other), small['checksum'])
+
+    def test_cache_entry_of_wrong_size_is_downloaded_again(self):
+        image = self.server.add_image('truncated', size=3 * MB)
+        cache_dir = self.path('cache')
+        self.assertTrue(self.download(image, self.path('a.img'),
+                                      cache_dir=cache_dir))
+        entry = os.path.join(cache_dir, self.cache.cache_key(image))
+        with open(entry, 'r+b') as f:
+            f.truncate(MB)
+
+        self.server.reset_calls()
+        target = self.path('b.img')
+        self.assertTrue(self.download(image, target, cache_dir=cache_dir))
+        self.assertEqual(self.file_gets(), 1)
+        self.assertEqual(md5sum(target), image['checksum'])
+
+    def write_partial(self, image, file_name, ranges, data=None):
+        """Leave an interrupted parallel download of image at file_name"""
+        partial = file_name + '.download'
+        with open(partial, 'wb') as f:
+            if data:
+                f.write(data)
+            f.truncate(image['size'])
+        with open(partial + '.part', 'w') as f:
+            json.dump({'image_id': image['id'], 'size': image['size'],
+                       'ranges': ranges}, f)
+        return partial
+
+    def test_parallel_download_resumes_saved_ranges(self):
+        image = self.server.add_image('resumed', size=4 * MB)
+        reference = self.path('reference.img')
+        self.assertTrue(self.download(image, reference))
+        with open(reference, 'rb') as f:
+            head = f.read(2 * MB)
+        target = self.path('disk.img')
+        # The first two ranges are complete, the third is half done
+        partial = self.write_partial(image, target, [
+            [0, MB - 1, MB],
+            [MB, 2 * MB - 1, 2 * MB],
+            [2 * MB, 3 * MB - 1, 2 * MB + MB // 2],
+            [3 * MB, 4 * MB - 1, 3 * MB],
+        ], head + head[:MB // 2])
+
+        self.server.reset_calls()
+        self.assertTrue(self.download(image, target, parallel=4))
+        self.assertEqual(self.file_gets(), 2)
+        self.assertEqual(md5sum(target), image['checksum'])
+        self.assertFalse(os.path.exists(partial))
+        self.assertFalse(os.path.exists(partial + '.part'))
+
+    def test_stale_ranges_of_another_image_are_not_resumed(self):
+        image = self.server.add_image('fresh', size=5 * MB)
+        target = self.path('disk.img')
+        self.write_partial({'id': 'another', 'size': 8 * MB}, target,
+                           [[0, 8 * MB - 1, 8 * MB]])
+
+        self.server.reset_calls()
+        self.assertTrue(self.download(image, target, parallel=4))
+        self.assertEqual(self.file_gets(), 4)
+        self.assertEqual(os.path.getsize(target), 5 * MB)
+        self.assertEqual(md5sum(target), image['checksum'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests of the image patch computation of the glancev2 states"""
+import os
+import unittest
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(CURDIR, '..', '_states', 'glancev2.py')
+
+
+def load_source(name, path):
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Loaded under another name, the glancev2 execution module package would
+# shadow it
+glancev2_state = load_source('glancev2_state', STATE_FILE)
+
+IMAGE = {
+    'id': 'b7f0c5d2-0a3b-4b7e-8e3a-8d1f4c5a6e7f',
+    'name': 'cirros',
+    'status': 'active',
+    'checksum': 'ee1eca47dc88f4879d8a229cc70a07c6',
+    'size': 13287936,
+    'visibility': 'public',
+    'protected': False,
+    'container_format': 'bare',
+    'disk_format': 'qcow2',
+    'min_disk': 0,
+    'tags': ['test', 'cirros'],
+    'os_glance_importing_to_stores': '',
+    'hw_disk_bus': 'virtio',
+    'custom/path': 'a',
+}
+
+
+class ImagePatchTest(unittest.TestCase):
+
+    def patch(self, properties, **kwargs):
+        return glancev2_state._image_patch(dict(IMAGE), properties, **kwargs)
+
+    def test_converged_image_needs_no_patch(self):
+        self.assertEqual(self.patch({
+            'name': 'cirros',
+            'visibility': 'public',
+            'disk_format': 'qcow2',
+            'hw_disk_bus': 'virtio',
+        }), [])
+
+    def test_tags_compare_as_sets(self):
+        self.assertEqual(self.patch({'tags': ['cirros', 'test', 'test']}),
+                         [])
+        self.assertEqual(self.patch({'tags': ['cirros']}), [
+            {'op': 'replace', 'path': '/tags', 'value': ['cirros']},
+        ])
+
+    def test_string_booleans_are_normalised(self):
+        self.assertEqual(self.patch({'protected': 'False'}), [])
+        self.assertEqual(self.patch({'protected': 'false'}), [])
+        self.assertEqual(self.patch({'protected': 'True'}), [
+            {'op': 'replace', 'path': '/protected', 'value': True},
+        ])
+
+    def test_changed_and_new_properties(self):
+        self.assertEqual(self.patch({
+            'visibility': 'private',
+            'min_ram': 512,
+            'hw_disk_bus': 'virtio',
+        }), [
+            {'op': 'add', 'path': '/min_ram', 'value': 512},
+            {'op': 'replace', 'path': '/visibility', 'value': 'private'},
+        ])
+
+    def test_read_only_properties_are_skipped(self):
+        self.assertEqual(self.patch({
+            'id': 'another-id',
+            'status': 'queued',
+            'checksum': 'another-checksum',
+            'size': 1,
+            'os_hash_value': 'digest',
+        }), [])
+
+    def test_property_names_are_escaped(self):
+        self.assertEqual(self.patch({'custom/path': 'b', 'a~b': 'c'}), [
+            {'op': 'add', 'path': '/a~0b', 'value': 'c'},
+            {'op': 'replace', 'path': '/custom~1path', 'value': 'b'},
+        ])
+
+    def test_remove_properties_keeps_base_and_glance_owned_keys(self):
+        self.assertEqual(self.patch({'name': 'cirros'},
+                                    remove_properties=True), [
+            {'op': 'remove', 'path': '/custom~1path'},
+            {'op': 'remove', 'path': '/hw_disk_bus'},
+        ])
+
+    def test_nothing_is_removed_by_default(self):
+        self.assertEqual(self.patch({'name': 'cirros'}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()